@@ -36,7 +36,7 @@ from lucterios.framework.tools import FORMTYPE_REFRESH, FORMTYPE_MODAL, CLOSE_NO
 from lucterios.framework.tools import ActionsManage
 from lucterios.framework.editors import LucteriosEditor
 
-from lucterios.contacts.models import PostalCode, CustomField
+from lucterios.contacts.models import PostalCode, CustomField, CustomFieldArgs
 from lucterios.CORE.parameters import Params
 from lucterios.framework import signal_and_lock
 from lucterios.CORE.views import ObjectPromote
@@ -126,7 +126,7 @@ parent.get('args_today').setVisible(type==5);
                     args[arg_name] = (args_val != 'False') and (args_val != '0') and (args_val != '') and (args_val != 'n')
                 else:
                     args[arg_name] = float(args_val)
-        self.item.args = str(args)
+        self.item.args = CustomFieldArgs.from_dict(args).to_text()
         LucteriosEditor.saving(self, xfer)
         self.item.save()
         self.item.check_associated()
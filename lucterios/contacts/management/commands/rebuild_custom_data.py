@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''
+Management command to rebuild or check denormalised custom values
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lucterios.contacts.models import AbstractContact, Possession
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the custom values stored on contacts and possessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', dest='check', default=False,
+                            help='Only list the objects whose stored custom values differ')
+
+    def handle(self, *args, **options):
+        for model in (AbstractContact, Possession):
+            if options['check']:
+                wrong_ids = model.check_custom_data()
+                self.stdout.write("%s: %d inconsistent %s" % (model.get_long_name(), len(wrong_ids), wrong_ids))
+            else:
+                nb_rebuilt = len(model.rebuild_custom_data())
+                self.stdout.write("%s: %d rebuilt" % (model.get_long_name(), nb_rebuilt))
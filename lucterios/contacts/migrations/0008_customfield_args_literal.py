@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Normalize custom field arguments
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from ast import literal_eval
+
+from django.db import migrations
+
+
+def parse_args(args_txt):
+    try:
+        args = literal_eval(args_txt)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        args = {}
+    if not isinstance(args, dict):
+        args = {}
+
+    def get_number(name):
+        value = args.get(name, 0)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        return 0
+    list_value = args.get('list', ())
+    if isinstance(list_value, str) or not isinstance(list_value, (list, tuple)):
+        list_value = ()
+    return str({'min': get_number('min'), 'max': get_number('max'), 'prec': get_number('prec'),
+                'list': [str(item) for item in list_value],
+                'multi': bool(args.get('multi', False)), 'today': bool(args.get('today', False))})
+
+
+def normalize_args(apps, schema_editor):
+    customfield = apps.get_model("contacts", "CustomField")
+    for cf_model in customfield.objects.all():
+        args_txt = parse_args(cf_model.args)
+        if args_txt != cf_model.args:
+            cf_model.args = args_txt
+            cf_model.save(update_fields=['args'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0007_customfield_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_args, migrations.RunPython.noop),
+    ]
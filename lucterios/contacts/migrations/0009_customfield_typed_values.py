@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Typed columns for custom field values
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+TYPED_VALUE_NAMES = ('value_int', 'value_real', 'value_date', 'value_bool')
+
+
+def get_typed_values(kind, value):
+    typed_values = dict([(typed_name, None) for typed_name in TYPED_VALUE_NAMES])
+    if kind in (1, 4):
+        value_fieldname = 'value_int'
+    elif kind == 2:
+        value_fieldname = 'value_real'
+    elif kind == 5:
+        value_fieldname = 'value_date'
+    elif kind == 3:
+        value_fieldname = 'value_bool'
+    else:
+        return typed_values
+    if value == '':
+        value = '0'
+    try:
+        if value_fieldname == 'value_int':
+            typed_values[value_fieldname] = int(value)
+        elif value_fieldname == 'value_real':
+            typed_values[value_fieldname] = Decimal(value)
+        elif value_fieldname == 'value_date':
+            typed_values[value_fieldname] = datetime.strptime(value, "%Y-%m-%d").date()
+        elif value_fieldname == 'value_bool':
+            typed_values[value_fieldname] = (value != 'False') and (value != '0') and (value != 'n')
+    except (TypeError, ValueError, InvalidOperation):
+        pass
+    return typed_values
+
+
+def fill_typed_values(apps, schema_editor):
+    customfield = apps.get_model("contacts", "CustomField")
+    for customvalue_name in ("ContactCustomField", "PossessionCustomField"):
+        customvalue = apps.get_model("contacts", customvalue_name)
+        for cf_model in customfield.objects.all():
+            ccf_to_update = []
+            for ccf_model in customvalue.objects.filter(field=cf_model).iterator(chunk_size=2000):
+                for typed_name, typed_value in get_typed_values(int(cf_model.kind), ccf_model.value).items():
+                    setattr(ccf_model, typed_name, typed_value)
+                ccf_to_update.append(ccf_model)
+            customvalue.objects.bulk_update(ccf_to_update, TYPED_VALUE_NAMES, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0008_customfield_args_literal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='value_int',
+            field=models.IntegerField(default=None, null=True, verbose_name='integer value'),
+        ),
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='value_real',
+            field=models.DecimalField(decimal_places=10, default=None, max_digits=30, null=True, verbose_name='real value'),
+        ),
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='value_date',
+            field=models.DateField(default=None, null=True, verbose_name='date value'),
+        ),
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='value_bool',
+            field=models.BooleanField(default=None, null=True, verbose_name='boolean value'),
+        ),
+        migrations.AddField(
+            model_name='possessioncustomfield',
+            name='value_int',
+            field=models.IntegerField(default=None, null=True, verbose_name='integer value'),
+        ),
+        migrations.AddField(
+            model_name='possessioncustomfield',
+            name='value_real',
+            field=models.DecimalField(decimal_places=10, default=None, max_digits=30, null=True, verbose_name='real value'),
+        ),
+        migrations.AddField(
+            model_name='possessioncustomfield',
+            name='value_date',
+            field=models.DateField(default=None, null=True, verbose_name='date value'),
+        ),
+        migrations.AddField(
+            model_name='possessioncustomfield',
+            name='value_bool',
+            field=models.BooleanField(default=None, null=True, verbose_name='boolean value'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'value_int'], name='contacts_ccf_int_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'value_real'], name='contacts_ccf_real_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'value_date'], name='contacts_ccf_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'value_bool'], name='contacts_ccf_bool_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='possessioncustomfield',
+            index=models.Index(fields=['field', 'value_int'], name='contacts_pcf_int_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='possessioncustomfield',
+            index=models.Index(fields=['field', 'value_real'], name='contacts_pcf_real_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='possessioncustomfield',
+            index=models.Index(fields=['field', 'value_date'], name='contacts_pcf_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='possessioncustomfield',
+            index=models.Index(fields=['field', 'value_bool'], name='contacts_pcf_bool_idx'),
+        ),
+        migrations.RunPython(fill_typed_values, migrations.RunPython.noop),
+    ]
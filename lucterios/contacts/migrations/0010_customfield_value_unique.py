@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Unique custom field value by owner
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Count, Min
+
+
+def remove_duplicate_values(apps, schema_editor):
+    for customvalue_name, owner_name in (("ContactCustomField", "contact"), ("PossessionCustomField", "possession")):
+        customvalue = apps.get_model("contacts", customvalue_name)
+        duplicates = customvalue.objects.values(owner_name, 'field').annotate(nb=Count('id'), first_id=Min('id')).filter(nb__gt=1)
+        for duplicate in duplicates:
+            customvalue.objects.filter(**{owner_name: duplicate[owner_name], 'field': duplicate['field']}).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0009_customfield_typed_values'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_values, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contactcustomfield',
+            constraint=models.UniqueConstraint(fields=('contact', 'field'), name='contacts_ccf_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='possessioncustomfield',
+            constraint=models.UniqueConstraint(fields=('possession', 'field'), name='contacts_pcf_unique'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+JSON copy of custom values
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_custom_data(apps, schema_editor):
+    for owner_name, customvalue_name, field_name in (("AbstractContact", "ContactCustomField", "contact_id"), ("Possession", "PossessionCustomField", "possession_id")):
+        owner = apps.get_model("contacts", owner_name)
+        customvalue = apps.get_model("contacts", customvalue_name)
+        item_ids = list(owner.objects.order_by('id').values_list('id', flat=True))
+        for index in range(0, len(item_ids), 500):
+            custom_data = dict([(item_id, {}) for item_id in item_ids[index:index + 500]])
+            for owner_id, field_id, value in customvalue.objects.filter(**{field_name + '__in': list(custom_data.keys())}).values_list(field_name, 'field_id', 'value'):
+                custom_data[owner_id][str(field_id)] = value
+            owner.objects.bulk_update([owner(id=item_id, custom_data=item_data) for item_id, item_data in custom_data.items()], ['custom_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0010_customfield_value_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abstractcontact',
+            name='custom_data',
+            field=models.JSONField(default=dict, editable=False, null=True, verbose_name='custom values'),
+        ),
+        migrations.AddField(
+            model_name='possession',
+            name='custom_data',
+            field=models.JSONField(default=dict, editable=False, null=True, verbose_name='custom values'),
+        ),
+        migrations.RunPython(fill_custom_data, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Concrete contact type on AbstractContact
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_final_modelname(apps, schema_editor):
+    abstractcontact = apps.get_model("contacts", "AbstractContact")
+    for final_name in ("LegalEntity", "Individual"):
+        final_model = apps.get_model("contacts", final_name)
+        abstractcontact.objects.filter(id__in=final_model.objects.values('pk')).update(final_modelname="contacts.%s" % final_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0011_custom_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abstractcontact',
+            name='final_modelname',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='final model'),
+        ),
+        migrations.RunPython(fill_final_modelname, migrations.RunPython.noop),
+    ]
@@ -25,23 +25,70 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 from os.path import exists, join, dirname
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from unicodedata import normalize, category
+from collections import namedtuple
+from copy import copy
+from ast import literal_eval
+import threading
 import logging
 
 from django.utils.translation import gettext_lazy as _
-from django.db.models.aggregates import Max
-from django.db import models
+from django.db.models.aggregates import Max, Count, Sum
+from django.db.models.query import QuerySet, ModelIterable
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.core.signals import request_started
+from django.db import models, transaction, connections
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 
 from lucterios.framework.models import LucteriosModel
 from lucterios.framework.model_fields import PrintFieldsPlugIn, get_value_if_choices, LucteriosVirtualField
 from lucterios.framework.filetools import get_user_path, readimage_to_base64
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.framework.tools import get_format_value
-from lucterios.framework.auditlog import auditlog
+from lucterios.framework.auditlog import auditlog, LucteriosAuditlogModelRegistry
 from lucterios.CORE.models import Parameter, LucteriosGroup, LucteriosUser
 from lucterios.mailing.email_functions import split_doubled_email
 
 
+class CustomFieldArgs(namedtuple('CustomFieldArgs', ['min', 'max', 'prec', 'list', 'multi', 'today'])):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+    @classmethod
+    def parse(cls, args_txt):
+        try:
+            args = literal_eval(args_txt)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            args = {}
+        return cls.from_dict(args)
+
+    @classmethod
+    def from_dict(cls, args):
+        if not isinstance(args, dict):
+            args = {}
+
+        def get_number(name):
+            value = args.get(name, 0)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return value
+            return 0
+        list_value = args.get('list', ())
+        if isinstance(list_value, str) or not isinstance(list_value, (list, tuple)):
+            list_value = ()
+        return cls(min=get_number('min'), max=get_number('max'), prec=get_number('prec'),
+                   list=tuple(str(item) for item in list_value),
+                   multi=bool(args.get('multi', False)), today=bool(args.get('today', False)))
+
+    def to_text(self):
+        return str({'min': self.min, 'max': self.max, 'prec': self.prec, 'list': list(self.list), 'multi': self.multi, 'today': self.today})
+
+
 class CustomField(LucteriosModel):
     KIND_STRING = 0
     KIND_INTEGER = 1
@@ -52,6 +99,8 @@ class CustomField(LucteriosModel):
 
     PREFIX_CUSTOM = "custom_"
 
+    TYPED_VALUE_NAMES = ('value_int', 'value_real', 'value_date', 'value_bool')
+
     modelname = models.CharField(_('model'), max_length=100)
     name = models.CharField(_('name'), max_length=200, unique=False)
     kind = models.IntegerField(_('kind'), choices=((KIND_STRING, _('String')),
@@ -64,10 +113,18 @@ class CustomField(LucteriosModel):
     model_title = LucteriosVirtualField(verbose_name=_('model'), compute_from='get_model_title')
     kind_txt = LucteriosVirtualField(verbose_name=_('kind'), compute_from='get_kind_txt')
     order_key = models.IntegerField(verbose_name=_('order key'), null=True, default=None)
+    version = models.IntegerField(verbose_name=_('version'), default=0, editable=False)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(CustomField, cls).from_db(db, field_names, values)
+        if 'kind' in instance.__dict__:
+            instance._original_kind = int(instance.kind)
+        return instance
+
     @classmethod
     def get_show_fields(cls):
         return ['modelname', 'name', 'kind']
@@ -112,16 +169,10 @@ class CustomField(LucteriosModel):
         return value.strip()
 
     def get_args(self):
-        default_args = {'min': 0, 'max': 0, 'prec': 0, 'list': [], 'multi': False, 'today': False}
-        try:
-            args = eval(self.args)
-        except Exception:
-            args = {}
-        for name, val in default_args.items():
-            if name not in args.keys():
-                args[name] = val
-        args['list'] = list(args['list'])
-        return args
+        if self.__dict__.get('_args_source') != self.args:
+            self._args_parsed = CustomFieldArgs.parse(self.args)
+            self._args_source = self.args
+        return self._args_parsed
 
     def get_field(self):
         from django.db.models.fields import IntegerField, DecimalField, BooleanField, TextField, DateField
@@ -145,6 +196,69 @@ class CustomField(LucteriosModel):
             dbfield = DateField(self.name)
         return dbfield
 
+    def get_value_fieldname(self):
+        if self.kind in (self.KIND_INTEGER, self.KIND_SELECT):
+            return 'value_int'
+        elif self.kind == self.KIND_REAL:
+            return 'value_real'
+        elif self.kind == self.KIND_DATE:
+            return 'value_date'
+        elif self.kind == self.KIND_BOOLEAN:
+            return 'value_bool'
+        else:
+            return 'value'
+
+    def get_typed_values(self, value):
+        typed_values = dict([(typed_name, None) for typed_name in self.TYPED_VALUE_NAMES])
+        value_fieldname = self.get_value_fieldname()
+        if value_fieldname in typed_values:
+            if value == '':
+                value = '0'
+            try:
+                if value_fieldname == 'value_int':
+                    typed_values[value_fieldname] = int(value)
+                elif value_fieldname == 'value_real':
+                    typed_values[value_fieldname] = Decimal(value)
+                elif value_fieldname == 'value_date':
+                    typed_values[value_fieldname] = datetime.strptime(value, "%Y-%m-%d").date()
+                elif value_fieldname == 'value_bool':
+                    typed_values[value_fieldname] = (value != 'False') and (value != '0') and (value != 'n')
+            except (TypeError, ValueError, InvalidOperation):
+                pass
+        return typed_values
+
+    def get_search_field(self, prefix):
+        return (self.get_fieldname(), self.get_field(), "%s__%s" % (prefix, self.get_value_fieldname()), models.Q(**{prefix + '__field__id': self.id}))
+
+    def refresh_typed_values(self, chunk_size=2000):
+        customize_field_class = self.model_associated().CustomFieldClass
+        ccf_to_update = []
+        for ccf_model in customize_field_class.objects.filter(field=self).iterator(chunk_size=chunk_size):
+            ccf_model.set_typed_values(self)
+            ccf_to_update.append(ccf_model)
+            if len(ccf_to_update) >= chunk_size:
+                customize_field_class.objects.bulk_update(ccf_to_update, self.TYPED_VALUE_NAMES)
+                ccf_to_update = []
+        customize_field_class.objects.bulk_update(ccf_to_update, self.TYPED_VALUE_NAMES)
+
+    def get_virtualfield(self):
+        format_num = None
+        if self.kind == self.KIND_INTEGER:
+            format_num = 'N0'
+        elif self.kind == self.KIND_REAL:
+            format_num = 'N%d' % self.get_args()['prec']
+        elif self.kind == self.KIND_BOOLEAN:
+            format_num = 'B'
+        elif self.kind == self.KIND_SELECT:
+            format_num = {}
+            args_list = self.get_args()['list']
+            for list_index in range(len(args_list)):
+                format_num[str(list_index)] = args_list[list_index]
+        elif self.kind == self.KIND_DATE:
+            format_num = 'D'
+        fieldname = self.get_fieldname()
+        return LucteriosVirtualField(verbose_name=self.name, name=fieldname, compute_from=fieldname, format_string=lambda: format_num)
+
     @classmethod
     def get_filter(cls, model):
         model_list = []
@@ -154,15 +268,7 @@ class CustomField(LucteriosModel):
 
     @classmethod
     def get_fields(cls, model):
-        fields = []
-        import inspect
-        model_list = []
-        for sub_class in inspect.getmro(model):
-            if hasattr(sub_class, "get_long_name"):
-                model_list.append(sub_class.get_long_name())
-        for cf_model in cls.objects.filter(modelname__in=model_list):
-            fields.append((cf_model.get_fieldname(), cf_model))
-        return fields
+        return CustomFieldRegistry.get_fields(model)
 
     @classmethod
     def edit_fields(cls, xfer, init_col, nb_col=2):
@@ -226,15 +332,43 @@ class CustomField(LucteriosModel):
                 self.order_key = 1
             else:
                 self.order_key = val['order_key__max'] + 1
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
-
-    def check_associated(self):
+        self.version += 1
+        if update_fields is not None:
+            update_fields = list(update_fields) + ['version']
+        old_kind = self.__dict__.get('_original_kind')
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        self._original_kind = int(self.kind)
+        if (old_kind is not None) and (old_kind != self._original_kind):
+            self.refresh_typed_values()
+        return res
+
+    def check_associated(self, chunk_size=2000, progress=None):
         sub_model_class = self.model_associated()
         customize_field_class = sub_model_class.CustomFieldClass
         customize_fieldname = "%s__field" % customize_field_class.__name__.lower()
-        fieldname = self.get_fieldname()
-        for sub_model_item in sub_model_class.objects.exclude(**{customize_fieldname: self}):
-            sub_model_item.set_custom_values({fieldname: getattr(sub_model_item, fieldname)})
+        owner_name = "%s_id" % sub_model_class.FieldName
+        default_item = sub_model_class()
+        default_value = default_item._get_custom_value_to_store(self, getattr(default_item, self.get_fieldname()))
+        audited = sub_model_class._custom_values_audited(customize_field_class)
+        missing_ids = list(sub_model_class.objects.exclude(**{customize_fieldname: self}).order_by('id').values_list('id', flat=True))
+        for index in range(0, len(missing_ids), chunk_size):
+            chunk_ids = missing_ids[index:index + chunk_size]
+            ccf_to_create = []
+            for item_id in chunk_ids:
+                ccf_model = customize_field_class(**{owner_name: item_id, 'field': self, 'value': default_value})
+                ccf_model.set_typed_values(self)
+                ccf_to_create.append(ccf_model)
+            if audited:
+                for ccf_model in ccf_to_create:
+                    ccf_model.save()
+            else:
+                customize_field_class.objects.bulk_create(ccf_to_create, batch_size=chunk_size, ignore_conflicts=True)
+            sub_model_class.rebuild_custom_data(chunk_ids, chunk_size)
+            if progress is not None:
+                progress(min(index + chunk_size, len(missing_ids)), len(missing_ids))
+        if len(missing_ids) > 0:
+            ContactsChangeCounter.increment()
+        return len(missing_ids)
 
     class Meta(object):
         verbose_name = _('custom field')
@@ -243,11 +377,216 @@ class CustomField(LucteriosModel):
         ordering = ['order_key']
 
 
+class CustomFieldRegistry(object):
+    '''
+    Process-wide copy of the custom field definitions.
+    Changes made by other processes are found by comparing a version read from the database
+    (number of fields, last id and sum of the save counters) with the one of the loaded copy.
+    The version is read once per request and at the first use in a thread.
+    '''
+
+    _FIELDS_BY_ID = None
+    _FIELDS_BY_MODEL = {}
+    _VIRTUALFIELDS = {}
+    _version = None
+    _registrylock = threading.RLock()
+    _writing = threading.local()
+    _checking = threading.local()
+
+    @classmethod
+    def clear(cls):
+        cls._registrylock.acquire()
+        try:
+            cls._FIELDS_BY_ID = None
+            cls._FIELDS_BY_MODEL.clear()
+            cls._VIRTUALFIELDS.clear()
+        finally:
+            cls._registrylock.release()
+
+    @classmethod
+    def invalidate(cls):
+        cls.clear()
+        cls._version = None
+
+    @classmethod
+    def field_changed(cls):
+        cls.invalidate()
+        connection = transaction.get_connection()
+        if connection.in_atomic_block:
+            cls._writing.atomic_block = connection.atomic_blocks[0]
+            transaction.on_commit(cls.invalidate)
+
+    @classmethod
+    def _in_writing_transaction(cls):
+        atomic_block = getattr(cls._writing, 'atomic_block', None)
+        if atomic_block is None:
+            return False
+        current_blocks = transaction.get_connection().atomic_blocks
+        if (len(current_blocks) > 0) and (current_blocks[0] is atomic_block):
+            return True
+        cls._writing.atomic_block = None
+        cls.clear()
+        return False
+
+    @classmethod
+    def _load(cls):
+        fields_by_id = {}
+        for cf_model in CustomField.objects.all().order_by('order_key', 'id'):
+            cf_model.get_args()
+            fields_by_id[cf_model.id] = cf_model
+        return fields_by_id
+
+    @classmethod
+    def must_check_version(cls, **_kwargs):
+        cls._checking.must_check = True
+
+    @classmethod
+    def _get_version(cls):
+        version = CustomField.objects.aggregate(nb=Count('id'), last_id=Max('id'), saves=Sum('version'))
+        return (version['nb'], version['last_id'], version['saves'])
+
+    @classmethod
+    def _get_fields_by_id(cls):
+        if getattr(cls._checking, 'must_check', True) or (cls._FIELDS_BY_ID is None):
+            cls._checking.must_check = False
+            version = cls._get_version()
+            if version != cls._version:
+                cls.clear()
+                cls._version = version
+        if cls._FIELDS_BY_ID is None:
+            cls._FIELDS_BY_ID = cls._load()
+        return cls._FIELDS_BY_ID
+
+    @classmethod
+    def _filter_fields(cls, fields_by_id, model):
+        import inspect
+        model_list = []
+        for sub_class in inspect.getmro(model):
+            if hasattr(sub_class, "get_long_name"):
+                model_list.append(sub_class.get_long_name())
+        fields = []
+        for cf_model in fields_by_id.values():
+            if cf_model.modelname in model_list:
+                fields.append((cf_model.get_fieldname(), cf_model))
+        return fields
+
+    @classmethod
+    def get_all(cls):
+        if cls._in_writing_transaction():
+            return list(cls._load().values())
+        cls._registrylock.acquire()
+        try:
+            return [copy(cf_model) for cf_model in cls._get_fields_by_id().values()]
+        finally:
+            cls._registrylock.release()
+
+    @classmethod
+    def get_field(cls, cf_id):
+        if cls._in_writing_transaction():
+            return CustomField.objects.get(id=cf_id)
+        cls._registrylock.acquire()
+        try:
+            fields_by_id = cls._get_fields_by_id()
+        finally:
+            cls._registrylock.release()
+        if cf_id not in fields_by_id:
+            raise CustomField.DoesNotExist("custom field %s unknown!" % cf_id)
+        return copy(fields_by_id[cf_id])
+
+    @classmethod
+    def get_virtualfield(cls, cf_id):
+        if cls._in_writing_transaction():
+            return CustomField.objects.get(id=cf_id).get_virtualfield()
+        cls._registrylock.acquire()
+        try:
+            fields_by_id = cls._get_fields_by_id()
+            if cf_id not in fields_by_id:
+                raise CustomField.DoesNotExist("custom field %s unknown!" % cf_id)
+            if cf_id not in cls._VIRTUALFIELDS:
+                cls._VIRTUALFIELDS[cf_id] = fields_by_id[cf_id].get_virtualfield()
+            return cls._VIRTUALFIELDS[cf_id]
+        finally:
+            cls._registrylock.release()
+
+    @classmethod
+    def get_fields(cls, model):
+        if cls._in_writing_transaction():
+            return cls._filter_fields(cls._load(), model)
+        cls._registrylock.acquire()
+        try:
+            fields_by_id = cls._get_fields_by_id()
+            model_name = model.get_long_name()
+            if model_name not in cls._FIELDS_BY_MODEL:
+                cls._FIELDS_BY_MODEL[model_name] = cls._filter_fields(fields_by_id, model)
+            return [(cf_name, copy(cf_model)) for cf_name, cf_model in cls._FIELDS_BY_MODEL[model_name]]
+        finally:
+            cls._registrylock.release()
+
+
+def customfield_post_change(sender, **kwargs):
+    CustomFieldRegistry.field_changed()
+
+
+post_save.connect(customfield_post_change, sender=CustomField)
+post_delete.connect(customfield_post_change, sender=CustomField)
+request_started.connect(CustomFieldRegistry.must_check_version)
+
+
+class ContactsChangeCounter(object):
+
+    VERSION_KEY = 'lucterios.contacts.version'
+
+    @classmethod
+    def get(cls):
+        return cache.get(cls.VERSION_KEY, 0)
+
+    @classmethod
+    def increment(cls):
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, None)
+
+
+def contacts_post_change(sender, **kwargs):
+    if sender._meta.app_label == 'contacts':
+        ContactsChangeCounter.increment()
+
+
+post_save.connect(contacts_post_change)
+post_delete.connect(contacts_post_change)
+m2m_changed.connect(contacts_post_change)
+
+
+class CustomImportBuffer(object):
+
+    def __init__(self, model):
+        self.model = model
+        self.values = []
+
+    def append(self, new_item, rowdata):
+        self.values.append((new_item, rowdata))
+        if len(self.values) >= CustomizeQuerySet.chunk_size:
+            self.flush()
+
+    def flush(self):
+        custom_import_values = self.values
+        self.values = []
+        if len(custom_import_values) > 0:
+            try:
+                self.model.bulk_set_custom_values(custom_import_values)
+            except Exception as import_error:
+                self.model.import_logs.append(str(import_error))
+                logging.getLogger('lucterios.contacts').exception("import_data")
+
+
 class CustomizeObject(object):
 
     CustomFieldClass = None
     FieldName = ''
 
+    _custom_imports = threading.local()
+
     @classmethod
     def get_fields_to_show(cls):
         fields_desc = []
@@ -266,6 +605,12 @@ class CustomizeObject(object):
     def _convert_model_for_attr(self, cf_model, ccf_model):
         return self._convert_value_for_attr(cf_model, ccf_model.value)
 
+    def _convert_attr_value(self, cf_model, ccf_value):
+        if cf_model.kind == CustomField.KIND_STRING:
+            return str(ccf_value)
+        else:
+            return self._convert_value_for_attr(cf_model, ccf_value)
+
     def _convert_value_for_attr(self, cf_model, ccf_value, args_list=[]):
         if ccf_value == '':
             ccf_value = '0'
@@ -290,24 +635,139 @@ class CustomizeObject(object):
                     ccf_value = datetime.strptime("1900-01-01", "%Y-%m-%d").date().isoformat()
         return ccf_value
 
+    def _get_custom_value_to_store(self, cf_model, cf_value):
+        args = cf_model.get_args()['list']
+        try:
+            cf_value = self._convert_value_for_attr(cf_model, cf_value, args)
+        except Exception:
+            cf_value = self._convert_value_for_attr(cf_model, '', args)
+        return str(cf_value)
+
+    def _get_update_fields(self, force_insert, update_fields):
+        if force_insert or (update_fields is not None) or self._state.adding:
+            return update_fields
+        deferred_fields = self.get_deferred_fields()
+        return [field.name for field in self._meta.concrete_fields if not field.primary_key and (field.name != 'custom_data') and (field.attname not in deferred_fields)]
+
     def set_custom_values(self, params):
-        for cf_name, cf_model in CustomField.get_fields(self.__class__):
-            if cf_name in params.keys():
-                cf_value = params[cf_name]
-                cf_id = int(cf_name[len(CustomField.PREFIX_CUSTOM):])
-                cf_model = CustomField.objects.get(id=cf_id)
-                args = cf_model.get_args()['list']
-                try:
-                    cf_value = self._convert_value_for_attr(cf_model, cf_value, args)
-                except Exception:
-                    cf_value = self._convert_value_for_attr(cf_model, '', args)
-                args = {self.FieldName: self, 'field': cf_model}
-                ccf_model = self.CustomFieldClass.objects.get_or_create(**args)
-                ccf_model[0].value = str(cf_value)
-                ccf_model[0].save()
+        self.__class__.bulk_set_custom_values([(self, params)])
+
+    @classmethod
+    def _custom_values_audited(cls, custom_field_class):
+        return auditlog.contains(custom_field_class) and LucteriosAuditlogModelRegistry.get_state(custom_field_class._meta.app_label)
+
+    @classmethod
+    def bulk_set_custom_values(cls, items_params, chunk_size=500):
+        values_by_class = {}
+        fields_by_class = {}
+        for item, params in items_params:
+            if item.__class__ not in fields_by_class:
+                fields_by_class[item.__class__] = CustomField.get_fields(item.__class__)
+            for cf_name, cf_model in fields_by_class[item.__class__]:
+                if cf_name in params.keys():
+                    new_values = values_by_class.setdefault((item.CustomFieldClass, item.FieldName), {})
+                    new_values[(item.id, cf_model.id)] = (item, cf_model, item._get_custom_value_to_store(cf_model, params[cf_name]))
+        for (custom_field_class, field_name), new_values in values_by_class.items():
+            if cls._custom_values_audited(custom_field_class):
+                cls._save_custom_values_audited(custom_field_class, field_name, new_values, chunk_size)
+            elif not connections[custom_field_class.objects.db].features.supports_update_conflicts_with_target:
+                cls._save_custom_values_bulk(custom_field_class, field_name, new_values, chunk_size)
+            else:
+                ccf_to_upsert = []
+                for item, cf_model, cf_value in new_values.values():
+                    ccf_model = custom_field_class(**{field_name: item, 'field': cf_model, 'value': cf_value})
+                    ccf_model.set_typed_values(cf_model)
+                    ccf_to_upsert.append(ccf_model)
+                custom_field_class.objects.bulk_create(ccf_to_upsert, batch_size=chunk_size, update_conflicts=True,
+                                                       unique_fields=[field_name, 'field'], update_fields=('value',) + CustomField.TYPED_VALUE_NAMES)
+            items = dict([(item.id, item) for item, _cf_model, _cf_value in new_values.values()])
+            custom_data = list(items.values())[0].rebuild_custom_data(list(items.keys()), chunk_size)
+            for item, cf_model, cf_value in new_values.values():
+                item.custom_data = custom_data[item.id]
+                if '_custom_values' in item.__dict__:
+                    item._custom_values[cf_model.id] = item._convert_attr_value(cf_model, cf_value)
+        if len(values_by_class) > 0:
+            ContactsChangeCounter.increment()
+
+    @classmethod
+    def _read_current_custom_values(cls, custom_field_class, field_name, new_values, chunk_size):
+        owner_name = "%s_id" % field_name
+        item_ids = list(set([item_id for item_id, _field_id in new_values.keys()]))
+        field_ids = list(set([field_id for _item_id, field_id in new_values.keys()]))
+        current_values = {}
+        for index in range(0, len(item_ids), chunk_size):
+            for ccf_model in custom_field_class.objects.filter(**{owner_name + '__in': item_ids[index:index + chunk_size], 'field_id__in': field_ids}):
+                current_values[(getattr(ccf_model, owner_name), ccf_model.field_id)] = ccf_model
+        return current_values
+
+    @classmethod
+    def _save_custom_values_bulk(cls, custom_field_class, field_name, new_values, chunk_size):
+        current_values = cls._read_current_custom_values(custom_field_class, field_name, new_values, chunk_size)
+        ccf_to_create = []
+        ccf_to_update = []
+        for ccf_key, (item, cf_model, cf_value) in new_values.items():
+            if ccf_key in current_values:
+                ccf_model = current_values[ccf_key]
+                if ccf_model.value != cf_value:
+                    ccf_model.value = cf_value
+                    ccf_model.set_typed_values(cf_model)
+                    ccf_to_update.append(ccf_model)
+            else:
+                ccf_model = custom_field_class(**{field_name: item, 'field': cf_model, 'value': cf_value})
+                ccf_model.set_typed_values(cf_model)
+                ccf_to_create.append(ccf_model)
+        custom_field_class.objects.bulk_create(ccf_to_create, batch_size=chunk_size)
+        custom_field_class.objects.bulk_update(ccf_to_update, ('value',) + CustomField.TYPED_VALUE_NAMES, batch_size=chunk_size)
+
+    @classmethod
+    def _save_custom_values_audited(cls, custom_field_class, field_name, new_values, chunk_size):
+        current_values = cls._read_current_custom_values(custom_field_class, field_name, new_values, chunk_size)
+        for ccf_key, (item, cf_model, cf_value) in new_values.items():
+            if ccf_key in current_values:
+                ccf_model = current_values[ccf_key]
+                if ccf_model.value != cf_value:
+                    ccf_model.value = cf_value
+                    ccf_model.save()
+            else:
+                custom_field_class.objects.create(**{field_name: item, 'field': cf_model, 'value': cf_value})
+
+    @classmethod
+    def _initialize_custom_import(cls):
+        setattr(cls._custom_imports, cls.get_long_name(), CustomImportBuffer(cls))
+
+    @classmethod
+    def _append_custom_import(cls, new_item, rowdata):
+        import_buffer = getattr(cls._custom_imports, cls.get_long_name(), None)
+        if import_buffer is None:
+            cls._initialize_custom_import()
+            import_buffer = getattr(cls._custom_imports, cls.get_long_name())
+        import_buffer.append(new_item, rowdata)
+
+    @classmethod
+    def _finalize_custom_import(cls):
+        import_buffer = getattr(cls._custom_imports, cls.get_long_name(), None)
+        try:
+            if import_buffer is not None:
+                import_buffer.flush()
+        finally:
+            setattr(cls._custom_imports, cls.get_long_name(), None)
+
+    def merge_custom_values(self, alias_objects):
+        owner_name = "%s_id" % self.FieldName
+        current_values = dict([(ccf_model.field_id, ccf_model) for ccf_model in self.CustomFieldClass.objects.filter(**{owner_name: self.id})])
+        for alias_object in alias_objects:
+            for alias_ccf in self.CustomFieldClass.objects.filter(**{owner_name: alias_object.id}):
+                if alias_ccf.field_id not in current_values:
+                    current_values[alias_ccf.field_id] = alias_ccf
+                    continue
+                current_ccf = current_values[alias_ccf.field_id]
+                if (current_ccf.value == '') and (alias_ccf.value != ''):
+                    current_ccf.value = alias_ccf.value
+                    current_ccf.save()
+                alias_ccf.delete()
 
     def get_custom_by_name(self, custom_name):
-        fields = CustomField.objects.filter(modelname=self.__class__.get_long_name(), name=custom_name)
+        fields = [cf_model for cf_model in CustomFieldRegistry.get_all() if (cf_model.modelname == self.__class__.get_long_name()) and (cf_model.name == custom_name)]
         if len(fields) == 1:
             return getattr(self, fields[0].get_fieldname())
         else:
@@ -315,66 +775,151 @@ class CustomizeObject(object):
 
     @classmethod
     def get_virtualfield(cls, name):
-        format_num = None
-        field_title = None
         if name == "str":
-            field_title = ''
+            return LucteriosVirtualField(verbose_name='', name=name, compute_from=name, format_string=lambda: None)
         elif name[:len(CustomField.PREFIX_CUSTOM)] == CustomField.PREFIX_CUSTOM:
-            cf_id = int(name[len(CustomField.PREFIX_CUSTOM):])
-            cf_model = CustomField.objects.get(id=cf_id)
-            field_title = cf_model.name
-            if cf_model.kind == CustomField.KIND_STRING:
-                format_num = None
-            elif cf_model.kind == CustomField.KIND_INTEGER:
-                format_num = 'N0'
-            elif cf_model.kind == CustomField.KIND_REAL:
-                format_num = 'N%d' % cf_model.get_args()['prec']
-            elif cf_model.kind == CustomField.KIND_BOOLEAN:
-                format_num = 'B'
-            elif cf_model.kind == CustomField.KIND_SELECT:
-                format_num = {}
-                args_list = cf_model.get_args()['list']
-                for list_index in range(len(args_list)):
-                    format_num[str(list_index)] = args_list[list_index]
-            elif cf_model.kind == CustomField.KIND_DATE:
-                format_num = 'D'
-        if field_title is not None:
-            return LucteriosVirtualField(verbose_name=field_title, name=name, compute_from=name, format_string=lambda: format_num)
+            return CustomFieldRegistry.get_virtualfield(int(name[len(CustomField.PREFIX_CUSTOM):]))
         return None
 
-    def _get_custom_for_attr(self, cf_model):
-        args = {self.FieldName: self, 'field': cf_model}
-        ccf_models = self.CustomFieldClass.objects.filter(**args)
-        if len(ccf_models) == 0:
-            ccf_model = self.CustomFieldClass.objects.create(**args)
-        elif len(ccf_models) == 1:
-            ccf_model = ccf_models[0]
-        else:
-            ccf_model = ccf_models[0]
-            for old_model in ccf_models[1:]:
-                old_model.delete()
-        return ccf_model
+    @classmethod
+    def load_custom_values(cls, items, chunk_size=500):
+        items_by_class = {}
+        for item in items:
+            if isinstance(item, CustomizeObject) and (item.id is not None):
+                items_by_class.setdefault(item.__class__, []).append(item)
+        for item_class, class_items in items_by_class.items():
+            cf_models = {}
+            for _cf_name, cf_model in CustomField.get_fields(item_class):
+                cf_models[cf_model.id] = cf_model
+            items_by_id = {}
+            for item in class_items:
+                item._custom_values = {}
+                custom_data = item.__dict__.get('custom_data')
+                if custom_data is None:
+                    items_by_id.setdefault(item.id, []).append(item)
+                else:
+                    for field_id, ccf_value in custom_data.items():
+                        if int(field_id) in cf_models:
+                            item._custom_values[int(field_id)] = item._convert_attr_value(cf_models[int(field_id)], ccf_value)
+            if (len(cf_models) == 0) or (len(items_by_id) == 0):
+                continue
+            owner_fieldname = "%s_id" % item_class.FieldName
+            item_ids = list(items_by_id.keys())
+            for chunk_idx in range(0, len(item_ids), chunk_size):
+                ccf_query = item_class.CustomFieldClass.objects.filter(**{owner_fieldname + '__in': item_ids[chunk_idx:chunk_idx + chunk_size],
+                                                                         'field_id__in': list(cf_models.keys())})
+                for owner_id, field_id, ccf_value in ccf_query.values_list(owner_fieldname, 'field_id', 'value'):
+                    for item in items_by_id[owner_id]:
+                        item._custom_values[field_id] = item._convert_attr_value(cf_models[field_id], ccf_value)
+        return items
+
+    @classmethod
+    def _get_custom_owner_model(cls):
+        return cls.CustomFieldClass._meta.get_field(cls.FieldName).related_model
+
+    @classmethod
+    def _read_custom_data(cls, item_ids):
+        owner_fieldname = "%s_id" % cls.FieldName
+        custom_data = dict([(item_id, {}) for item_id in item_ids])
+        ccf_query = cls.CustomFieldClass.objects.filter(**{owner_fieldname + '__in': item_ids})
+        for owner_id, field_id, ccf_value in ccf_query.values_list(owner_fieldname, 'field_id', 'value'):
+            custom_data[owner_id][str(field_id)] = ccf_value
+        return custom_data
+
+    @classmethod
+    def rebuild_custom_data(cls, item_ids=None, chunk_size=500):
+        owner_model = cls._get_custom_owner_model()
+        if item_ids is None:
+            item_ids = list(owner_model.objects.order_by('id').values_list('id', flat=True))
+        custom_data = {}
+        for index in range(0, len(item_ids), chunk_size):
+            chunk_data = cls._read_custom_data(item_ids[index:index + chunk_size])
+            owner_model.objects.bulk_update([owner_model(id=item_id, custom_data=item_data) for item_id, item_data in chunk_data.items()], ['custom_data'])
+            custom_data.update(chunk_data)
+        return custom_data
+
+    @classmethod
+    def check_custom_data(cls, chunk_size=500):
+        owner_model = cls._get_custom_owner_model()
+        field_ids = set([str(cf_model.id) for cf_model in CustomFieldRegistry.get_all()])
+        item_ids = list(owner_model.objects.order_by('id').values_list('id', flat=True))
+        wrong_ids = []
+        for index in range(0, len(item_ids), chunk_size):
+            chunk_ids = item_ids[index:index + chunk_size]
+            chunk_data = cls._read_custom_data(chunk_ids)
+            for item_id, item_data in owner_model.objects.filter(id__in=chunk_ids).values_list('id', 'custom_data'):
+                if item_data is not None:
+                    item_data = dict([(field_id, ccf_value) for field_id, ccf_value in item_data.items() if field_id in field_ids])
+                if item_data != chunk_data[item_id]:
+                    wrong_ids.append(item_id)
+        return wrong_ids
+
+    def reset_custom_values(self):
+        if '_custom_values' in self.__dict__:
+            del self.__dict__['_custom_values']
+
+    def _get_custom_values(self):
+        if '_custom_values' not in self.__dict__:
+            prefetch_items, item_idx = self.__dict__.get('_custom_prefetch', ([self], 0))
+            chunk_items = prefetch_items[item_idx:item_idx + CustomizeQuerySet.chunk_size]
+            self.load_custom_values([item for item in chunk_items if '_custom_values' not in item.__dict__])
+        return self._custom_values
 
     def __getattr__(self, name):
         if name == "str":
             return str(self.get_final_child())
         elif name[:len(CustomField.PREFIX_CUSTOM)] == CustomField.PREFIX_CUSTOM:
             cf_id = int(name[len(CustomField.PREFIX_CUSTOM):])
-            cf_model = CustomField.objects.get(id=cf_id)
-            if self.id is None:
-                ccf_value = ""
-                if cf_model.kind != CustomField.KIND_STRING:
-                    ccf_value = self._convert_value_for_attr(cf_model, ccf_value)
-            else:
-                ccf_model = self._get_custom_for_attr(cf_model)
-                if cf_model.kind == CustomField.KIND_STRING:
-                    ccf_value = str(ccf_model.value)
-                else:
-                    ccf_value = self._convert_model_for_attr(cf_model, ccf_model)
+            if self.id is not None:
+                custom_values = self._get_custom_values()
+                if cf_id in custom_values:
+                    return custom_values[cf_id]
+            cf_model = CustomFieldRegistry.get_field(cf_id)
+            ccf_value = ""
+            if cf_model.kind != CustomField.KIND_STRING:
+                ccf_value = self._convert_value_for_attr(cf_model, ccf_value)
+            if self.id is not None:
+                custom_values[cf_id] = ccf_value
             return ccf_value
         raise AttributeError(name)
 
 
+class CustomizeQuerySet(QuerySet):
+
+    chunk_size = 500
+
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        QuerySet.__init__(self, model=model, query=query, using=using, hints=hints)
+        self._with_custom_fields = False
+
+    def _clone(self):
+        clone = QuerySet._clone(self)
+        clone._with_custom_fields = self._with_custom_fields
+        return clone
+
+    def with_custom_fields(self):
+        clone = self._chain()
+        clone._with_custom_fields = True
+        return clone
+
+    def _fetch_all(self):
+        must_prefetch = (self._result_cache is None) and self._with_custom_fields and issubclass(self._iterable_class, ModelIterable)
+        QuerySet._fetch_all(self)
+        if must_prefetch:
+            prefetch_items = list(self._result_cache)
+            for item_idx, item in enumerate(prefetch_items):
+                item._custom_prefetch = (prefetch_items, item_idx)
+
+
+class ContactQuerySet(CustomizeQuerySet):
+
+    def with_final_child(self):
+        final_relations = self.model.get_final_child_relations()
+        if len(final_relations) == 0:
+            return self._chain()
+        return self.select_related(*final_relations)
+
+
 class PostalCode(LucteriosModel):
     postal_code = models.CharField(_('postal code'), max_length=10, blank=False)
     city = models.CharField(_('city'), max_length=100, blank=False)
@@ -433,20 +978,83 @@ class StructureType(LucteriosModel):
         default_permissions = []
 
 
+class CustomValueQuerySet(QuerySet):
+
+    def _get_owner_ids(self):
+        return list(set(self.values_list("%s_id" % self.model.OwnerName, flat=True)))
+
+    def _rebuild_custom_data(self, owner_ids):
+        if len(owner_ids) > 0:
+            owner_model = self.model._meta.get_field(self.model.OwnerName).related_model
+            owner_model.rebuild_custom_data(owner_ids)
+
+    def update(self, **kwargs):
+        owner_fields = (self.model.OwnerName, "%s_id" % self.model.OwnerName)
+        if len(set(kwargs.keys()) & set(('value', 'field', 'field_id') + owner_fields)) == 0:
+            return QuerySet.update(self, **kwargs)
+        owner_ids = self._get_owner_ids()
+        for owner_field in owner_fields:
+            if owner_field in kwargs:
+                owner_ids.append(getattr(kwargs[owner_field], 'pk', kwargs[owner_field]))
+        res = QuerySet.update(self, **kwargs)
+        self._rebuild_custom_data(owner_ids)
+        return res
+
+    def delete(self):
+        owner_ids = self._get_owner_ids()
+        res = QuerySet.delete(self)
+        self._rebuild_custom_data(owner_ids)
+        return res
+
+
 class ContactCustomField(LucteriosModel):
+    OwnerName = 'contact'
+
+    objects = CustomValueQuerySet.as_manager()
+
     contact = models.ForeignKey('AbstractContact', verbose_name=_('contact'), null=False, on_delete=models.CASCADE)
     field = models.ForeignKey('CustomField', verbose_name=_('field'), null=False, on_delete=models.CASCADE)
     value = models.TextField(_('value'), default="")
+    value_int = models.IntegerField(_('integer value'), null=True, default=None)
+    value_real = models.DecimalField(_('real value'), max_digits=30, decimal_places=10, null=True, default=None)
+    value_date = models.DateField(_('date value'), null=True, default=None)
+    value_bool = models.BooleanField(_('boolean value'), null=True, default=None)
 
     data = LucteriosVirtualField(verbose_name=_('value'), compute_from=lambda item: item.field.convert_data(item.value))
 
     def get_auditlog_object(self):
         return self.contact.get_final_child()
 
+    def set_typed_values(self, cf_model=None):
+        if cf_model is None:
+            cf_model = self.field
+        for typed_name, typed_value in cf_model.get_typed_values(self.value).items():
+            setattr(self, typed_name, typed_value)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.set_typed_values()
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        AbstractContact.rebuild_custom_data([self.contact_id])
+        return res
+
+    def delete(self, using=None):
+        res = LucteriosModel.delete(self, using=using)
+        AbstractContact.rebuild_custom_data([self.contact_id])
+        return res
+
     class Meta(object):
         verbose_name = _('custom field value')
         verbose_name_plural = _('custom field values')
         default_permissions = []
+        indexes = [
+            models.Index(fields=['field', 'value_int'], name='contacts_ccf_int_idx'),
+            models.Index(fields=['field', 'value_real'], name='contacts_ccf_real_idx'),
+            models.Index(fields=['field', 'value_date'], name='contacts_ccf_date_idx'),
+            models.Index(fields=['field', 'value_bool'], name='contacts_ccf_bool_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['contact', 'field'], name='contacts_ccf_unique'),
+        ]
 
 
 class AbstractContact(LucteriosModel, CustomizeObject):
@@ -454,6 +1062,8 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     CustomFieldClass = ContactCustomField
     FieldName = 'contact'
 
+    objects = ContactQuerySet.as_manager()
+
     address = models.TextField(_('address'), blank=False)
     postal_code = models.CharField(_('postal code'), max_length=10, blank=False)
     city = models.CharField(_('city'), max_length=100, blank=False)
@@ -462,6 +1072,8 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     tel2 = models.CharField(_('tel2'), max_length=20, blank=True)
     email = models.EmailField(_('email'), blank=True)
     comment = models.TextField(_('comment'), blank=True)
+    custom_data = models.JSONField(_('custom values'), null=True, default=dict, editable=False)
+    final_modelname = models.CharField(_('final model'), max_length=100, blank=True, default='', editable=False)
 
     def __str__(self):
         final_child = self.get_final_child(1)
@@ -477,6 +1089,53 @@ class AbstractContact(LucteriosModel, CustomizeObject):
             dep_field = super(AbstractContact, cls).get_field_by_name(fieldname)
         return dep_field
 
+    @classmethod
+    def get_final_child_relations(cls):
+        final_relations = []
+        for sub_class in cls.__subclasses__():
+            if issubclass(sub_class, models.Model) and not sub_class._meta.abstract and not sub_class._meta.proxy:
+                final_relations.append(sub_class._meta.model_name)
+        return final_relations
+
+    def _get_final_model(self):
+        from django.apps import apps
+        if self.final_modelname == '':
+            return None
+        try:
+            return apps.get_model(self.final_modelname)
+        except LookupError:
+            return None
+
+    def get_final_child(self, num=None):
+        final_model = self._get_final_model()
+        if final_model is self.__class__:
+            return self
+        if (final_model is not None) and (self.__class__ in final_model._meta.parents):
+            try:
+                final_child = getattr(self, final_model._meta.model_name)
+                if (num is None) and (len(final_child.get_final_child_relations()) > 0):
+                    final_child = final_child.get_final_child()
+                return final_child
+            except ObjectDoesNotExist:
+                pass
+        if num is None:
+            return LucteriosModel.get_final_child(self)
+        else:
+            return LucteriosModel.get_final_child(self, num)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        final_model = self._get_final_model()
+        if (final_model is None) or ((self.__class__ is not final_model) and issubclass(self.__class__, final_model)):
+            self.final_modelname = self.__class__.get_long_name()
+        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=self._get_update_fields(force_insert, update_fields))
+
+    @transaction.atomic
+    def merge_objects(self, alias_objects=[]):
+        if not isinstance(alias_objects, list):
+            alias_objects = [alias_objects]
+        self.merge_custom_values(alias_objects)
+        return LucteriosModel.merge_objects(self, alias_objects)
+
     @classmethod
     def get_default_fields(cls):
         return [(_('contact'), 'str'), 'tel1', 'tel2', 'email']
@@ -496,9 +1155,8 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     def get_search_fields(cls, with_addon=True):
         fieldnames = []
         fieldnames.extend(['address', 'postal_code', 'city', 'country', 'tel1', 'tel2', 'email', 'comment'])
-        from django.db.models import Q
-        for cf_name, cf_model in CustomField.get_fields(cls):
-            fieldnames.append((cf_name, cf_model.get_field(), 'contactcustomfield__value', Q(contactcustomfield__field__id=cf_model.id)))
+        for _cf_name, cf_model in CustomField.get_fields(cls):
+            fieldnames.append(cf_model.get_search_field('contactcustomfield'))
         if with_addon:
             Signal.call_signal("addon_search", cls, fieldnames)
         return fieldnames
@@ -514,21 +1172,35 @@ class AbstractContact(LucteriosModel, CustomizeObject):
             fields.append((field[0], field[1].name))
         return fields
 
+    @classmethod
+    def initialize_import(cls):
+        super(AbstractContact, cls).initialize_import()
+        cls._initialize_custom_import()
+
     @classmethod
     def import_data(cls, rowdata, dateformat):
         try:
             new_item = super(AbstractContact, cls).import_data(rowdata, dateformat)
             if new_item is not None:
-                new_item.set_custom_values(rowdata)
+                cls._append_custom_import(new_item, rowdata)
             return new_item
         except Exception as import_error:
             cls.import_logs.append(str(import_error))
             logging.getLogger('lucterios.contacts').exception("import_data")
             return None
 
+    @classmethod
+    def finalize_import(cls):
+        cls._finalize_custom_import()
+        return super(AbstractContact, cls).finalize_import()
+
     def get_presentation(self):
         return ""
 
+    def get_print_version(self):
+        final_child = self.get_final_child()
+        return repr([field.value_from_object(final_child) for field in final_child._meta.concrete_fields])
+
     def get_email(self, only_main=None):
         email_list = []
         contact = self.get_final_child()
@@ -607,9 +1279,29 @@ class LegalEntity(AbstractContact):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def load_members(cls, entities, chunk_size=500):
+        entities_by_id = {}
+        for entity in entities:
+            if isinstance(entity, LegalEntity) and (entity.id is not None):
+                entity._members = []
+                entities_by_id.setdefault(entity.id, []).append(entity)
+        entity_ids = list(entities_by_id.keys())
+        for index in range(0, len(entity_ids), chunk_size):
+            member_query = Individual.objects.filter(responsability__legal_entity__in=entity_ids[index:index + chunk_size])
+            for indiv in member_query.annotate(member_of=models.F('responsability__legal_entity')):
+                for entity in entities_by_id[indiv.member_of]:
+                    entity._members.append(indiv)
+        return entities
+
+    def get_members(self):
+        if '_members' not in self.__dict__:
+            self.load_members([self])
+        return self._members
+
     def get_presentation(self):
         sub_contact = []
-        for indiv in Individual.objects.filter(responsability__legal_entity=self):
+        for indiv in self.get_members():
             if len(split_doubled_email([indiv.email])) != 0:
                 sub_contact.append(indiv.get_presentation())
         if len(sub_contact) == 0:
@@ -620,9 +1312,12 @@ class LegalEntity(AbstractContact):
     def get_email(self, only_main=None):
         email_list = AbstractContact.get_email(self, only_main)
         if only_main is not True:
-            for indiv in Individual.objects.filter(responsability__legal_entity=self).distinct():
-                if indiv.email != '':
-                    email_list.append(indiv.email)
+            member_ids = []
+            for indiv in self.get_members():
+                if indiv.id not in member_ids:
+                    member_ids.append(indiv.id)
+                    if indiv.email != '':
+                        email_list.append(indiv.email)
         return email_list
 
     def can_delete(self):
@@ -766,29 +1461,66 @@ class CategoryPossession(LucteriosModel):
 
 
 class PossessionCustomField(LucteriosModel):
+    OwnerName = 'possession'
+
+    objects = CustomValueQuerySet.as_manager()
+
     possession = models.ForeignKey('Possession', verbose_name=_('possession'), null=False, on_delete=models.CASCADE)
     field = models.ForeignKey('CustomField', verbose_name=_('field'), null=False, on_delete=models.CASCADE)
     value = models.TextField(_('value'), default="")
+    value_int = models.IntegerField(_('integer value'), null=True, default=None)
+    value_real = models.DecimalField(_('real value'), max_digits=30, decimal_places=10, null=True, default=None)
+    value_date = models.DateField(_('date value'), null=True, default=None)
+    value_bool = models.BooleanField(_('boolean value'), null=True, default=None)
 
     data = LucteriosVirtualField(verbose_name=_('value'), compute_from=lambda item: item.field.convert_data(item.value))
 
     def get_auditlog_object(self):
         return self.possession.get_final_child()
 
+    def set_typed_values(self, cf_model=None):
+        if cf_model is None:
+            cf_model = self.field
+        for typed_name, typed_value in cf_model.get_typed_values(self.value).items():
+            setattr(self, typed_name, typed_value)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.set_typed_values()
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        Possession.rebuild_custom_data([self.possession_id])
+        return res
+
+    def delete(self, using=None):
+        res = LucteriosModel.delete(self, using=using)
+        Possession.rebuild_custom_data([self.possession_id])
+        return res
+
     class Meta(object):
         verbose_name = _('custom field value')
         verbose_name_plural = _('custom field values')
         default_permissions = []
+        indexes = [
+            models.Index(fields=['field', 'value_int'], name='contacts_pcf_int_idx'),
+            models.Index(fields=['field', 'value_real'], name='contacts_pcf_real_idx'),
+            models.Index(fields=['field', 'value_date'], name='contacts_pcf_date_idx'),
+            models.Index(fields=['field', 'value_bool'], name='contacts_pcf_bool_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['possession', 'field'], name='contacts_pcf_unique'),
+        ]
 
 
 class Possession(LucteriosModel, CustomizeObject):
     CustomFieldClass = PossessionCustomField
     FieldName = 'possession'
 
+    objects = CustomizeQuerySet.as_manager()
+
     category_possession = models.ForeignKey(CategoryPossession, verbose_name=_('category'), null=False, on_delete=models.PROTECT)
     name = models.CharField(_('name'), max_length=100, blank=False)
     owner = models.ForeignKey('AbstractContact', verbose_name=_('owner'), null=True, default=None, on_delete=models.PROTECT)
     comment = models.TextField(_('comment'), blank=True)
+    custom_data = models.JSONField(_('custom values'), null=True, default=dict, editable=False)
 
     def __str__(self):
         return str(self.name)
@@ -832,8 +1564,8 @@ class Possession(LucteriosModel, CustomizeObject):
     @classmethod
     def get_search_fields(cls, with_addon=True):
         fieldnames = ["category_possession", "name"]
-        for cf_name, cf_model in CustomField.get_fields(cls):
-            fieldnames.append((cf_name, cf_model.get_field(), 'possessioncustomfield__value', models.Q(possessioncustomfield__field__id=cf_model.id)))
+        for _cf_name, cf_model in CustomField.get_fields(cls):
+            fieldnames.append(cf_model.get_search_field('possessioncustomfield'))
         fieldnames.extend(["comment"])
         fieldnames.append(cls.convert_field_for_search('owner', ('name', LegalEntity._meta.get_field('name'), 'legalentity__name', models.Q())))
         fieldnames.append(cls.convert_field_for_search('owner', ('firstname', Individual._meta.get_field('firstname'), 'individual__firstname', models.Q())))
@@ -853,18 +1585,31 @@ class Possession(LucteriosModel, CustomizeObject):
             img = readimage_to_base64(join(dirname(__file__), "static", 'lucterios.contacts', "images", "NoImage.png"))
         return img.decode('ascii')
 
+    @classmethod
+    def initialize_import(cls):
+        super(Possession, cls).initialize_import()
+        cls._initialize_custom_import()
+
     @classmethod
     def import_data(cls, rowdata, dateformat):
         try:
             new_item = super(Possession, cls).import_data(rowdata, dateformat)
             if new_item is not None:
-                new_item.set_custom_values(rowdata)
+                cls._append_custom_import(new_item, rowdata)
             return new_item
         except Exception as import_error:
             cls.import_logs.append(str(import_error))
             logging.getLogger('lucterios.contacts').exception("import_data")
             return None
 
+    @classmethod
+    def finalize_import(cls):
+        cls._finalize_custom_import()
+        return super(Possession, cls).finalize_import()
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=self._get_update_fields(force_insert, update_fields))
+
     def delete(self, using=None):
         for custom in self.possessioncustomfield_set.all():
             custom.delete()
@@ -901,9 +1646,8 @@ def possession_addon_search(model, search_result):
     if issubclass(model, AbstractContact) and (CategoryPossession.objects.all().count() > 0):
         for field_name in ["category_possession", "name", "comment"]:
             search_result.append(model.convert_field_for_search('possession_set', (field_name, Possession._meta.get_field(field_name), field_name, models.Q())))
-        for cf_name, cf_model in CustomField.get_fields(Possession):
-            field = (cf_name, cf_model.get_field(), 'possessioncustomfield__value', models.Q(possessioncustomfield__field__id=cf_model.id))
-            search_result.append(model.convert_field_for_search('possession_set', field))
+        for _cf_name, cf_model in CustomField.get_fields(Possession):
+            search_result.append(model.convert_field_for_search('possession_set', cf_model.get_search_field('possessioncustomfield')))
         res = True
     return res
 
@@ -914,7 +1658,7 @@ def contacts_convertdata():
         custom.save()
     for custom in CustomField.objects.all():
         print("convert contact customize field", custom)
-        custom.check_associated()
+        custom.check_associated(progress=lambda nb_done, nb_total: print(" - %d/%d" % (nb_done, nb_total)))
 
 
 @Signal.decorate('checkparam')
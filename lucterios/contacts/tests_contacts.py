@@ -26,6 +26,7 @@ from __future__ import unicode_literals
 from os.path import join, dirname, exists
 from _io import StringIO
 from base64 import b64decode
+from threading import Thread
 
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.filetools import readimage_to_base64, get_user_path
@@ -34,7 +35,8 @@ from lucterios.CORE.views_usergroup import UsersEdit
 from lucterios.CORE.views import ObjectMerge
 
 from lucterios.contacts.views import Configuration, CustomFieldAddModify, ContactImport
-from lucterios.contacts.models import LegalEntity, Individual, Function, Responsability, CustomField, ContactCustomField
+from lucterios.contacts.models import LegalEntity, Individual, Function, Responsability, CustomField, ContactCustomField, \
+    CustomFieldRegistry, CustomFieldArgs, AbstractContact
 from lucterios.contacts.test_tools import initial_contact, create_jack
 from lucterios.contacts.views_contacts import IndividualList, LegalEntityList, \
     LegalEntityAddModify, IndividualAddModify, IndividualShow, IndividualUserAdd, \
@@ -828,6 +830,207 @@ class ContactsTest(LucteriosTest):
         find_indiv = list(Individual.objects.filter(q_res))
         self.assertEqual(1, len(find_indiv), find_indiv)
 
+    def test_custom_fields_search_typed(self):
+        from django.db.models import Q
+        self._initial_custom_values()
+        create_jack(firstname="jean", lastname="DUPOND", custom_2="12", custom_3="-2.5", custom_5="3")
+        Individual.objects.get(id=2).set_custom_values({'custom_2': '45', 'custom_3': '7.25'})
+        fieldnames = Individual.get_search_fields()
+        self.assertEqual('contactcustomfield__value', fieldnames[-9][2])
+        self.assertEqual('contactcustomfield__value_int', fieldnames[-8][2])
+        self.assertEqual('contactcustomfield__value_real', fieldnames[-7][2])
+        self.assertEqual('contactcustomfield__value_int', fieldnames[-6][2])
+        self.assertEqual([(2, 45), (3, 12)], list(ContactCustomField.objects.filter(field_id=2).order_by('contact_id').values_list('contact_id', 'value_int')))
+
+        q_res = Q(contactcustomfield__field__id=2) & Q(contactcustomfield__value_int__gte=20)
+        self.assertEqual(['jack'], [indiv.firstname for indiv in Individual.objects.filter(q_res)])
+        q_res = Q(contactcustomfield__field__id=3) & Q(contactcustomfield__value_real__lt=0)
+        self.assertEqual(['jean'], [indiv.firstname for indiv in Individual.objects.filter(q_res)])
+        q_res = Q(contactcustomfield__field__id=5) & Q(contactcustomfield__value_int=3)
+        self.assertEqual(['jean'], [indiv.firstname for indiv in Individual.objects.filter(q_res)])
+
+        cf_model = CustomField.objects.get(id=2)
+        cf_model.kind = CustomField.KIND_STRING
+        cf_model.save()
+        self.assertEqual([None, None], list(ContactCustomField.objects.filter(field_id=2).values_list('value_int', flat=True)))
+
+    def test_custom_fields_cache(self):
+        self._initial_custom_values()
+        create_jack(firstname="jean", lastname="DUPOND", custom_1="pas mal", custom_2="12", custom_5="0")
+        jack = Individual.objects.get(id=2)
+        jack.set_custom_values({'custom_1': 'super', 'custom_2': '', 'custom_5': '3'})
+
+        indiv_list = Individual.load_custom_values(list(Individual.objects.all().order_by('id')))
+        self.assertEqual(2, len(indiv_list))
+        with self.assertNumQueries(0):
+            self.assertEqual(['super', 'pas mal'], [indiv.custom_1 for indiv in indiv_list])
+            self.assertEqual([0, 12], [indiv.custom_2 for indiv in indiv_list])
+            self.assertEqual([3, 0], [indiv.custom_5 for indiv in indiv_list])
+
+        indiv_list[0].set_custom_values({'custom_2': '25'})
+        with self.assertNumQueries(0):
+            self.assertEqual(25, indiv_list[0].custom_2)
+        self.assertEqual(25, Individual.objects.get(id=2).custom_2)
+
+        with self.assertNumQueries(2):
+            indiv_list = Individual.objects.filter(firstname__in=('jack', 'jean')).order_by('id').with_custom_fields()
+            self.assertEqual([('super', 25, 3), ('pas mal', 12, 0)], [(indiv.custom_1, indiv.custom_2, indiv.custom_5) for indiv in indiv_list])
+
+    def test_custom_fields_bulk(self):
+        self._initial_custom_values()
+        create_jack(firstname="jean", lastname="DUPOND")
+        jack = Individual.objects.get(id=2)
+        jean = Individual.objects.get(id=3)
+        with self.assertNumQueries(4):
+            Individual.bulk_set_custom_values([(jack, {'custom_1': 'aaa', 'custom_2': '5'}), (jean, {'custom_1': 'bbb', 'custom_5': '2', 'custom_4': 'no'})])
+        self.assertEqual(2, ContactCustomField.objects.filter(contact_id=2).count())
+        self.assertEqual(2, ContactCustomField.objects.filter(contact_id=3).count())
+
+        with self.assertNumQueries(4):
+            Individual.bulk_set_custom_values([(jack, {'custom_2': '7'}), (jean, {'custom_1': 'bbb', 'custom_5': 'abc'})])
+        self.assertEqual(['aaa', 7], [Individual.objects.get(id=2).custom_1, Individual.objects.get(id=2).custom_2])
+        self.assertEqual(['bbb', 0], [Individual.objects.get(id=3).custom_1, Individual.objects.get(id=3).custom_5])
+        self.assertEqual(4, ContactCustomField.objects.filter(contact_id__in=(2, 3)).count())
+
+    def test_custom_fields_data(self):
+        self._initial_custom_values()
+        create_jack(firstname="jean", lastname="DUPOND", custom_1="pas mal", custom_2="12")
+        self.assertEqual({'1': 'pas mal', '2': '12'}, Individual.objects.get(id=3).custom_data)
+        self.assertEqual([], Individual.check_custom_data())
+
+        CustomField.objects.get(id=2).check_associated()
+        self.assertEqual({'2': '0'}, Individual.objects.get(id=2).custom_data)
+        self.assertEqual([], Individual.check_custom_data())
+
+        ContactCustomField.objects.filter(contact_id=3, field_id=1).update(value='super')
+        self.assertEqual([], Individual.check_custom_data())
+        self.assertEqual('super', Individual.objects.get(id=3).custom_1)
+
+        stale_jean = Individual.objects.get(id=3)
+        Individual.objects.get(id=3).set_custom_values({'custom_2': '25'})
+        stale_jean.comment = 'stale'
+        stale_jean.save()
+        self.assertEqual({'1': 'super', '2': '25'}, Individual.objects.get(id=3).custom_data)
+        self.assertEqual('stale', Individual.objects.get(id=3).comment)
+
+        ContactCustomField.objects.filter(contact_id=3, field_id=1).delete()
+        self.assertEqual({'2': '25'}, Individual.objects.get(id=3).custom_data)
+
+        AbstractContact.objects.filter(id=3).update(custom_data={'2': '99'})
+        self.assertEqual([3], Individual.check_custom_data())
+        self.assertEqual(99, Individual.objects.get(id=3).custom_2)
+        Individual.rebuild_custom_data()
+        self.assertEqual([], Individual.check_custom_data())
+        self.assertEqual(25, Individual.objects.get(id=3).custom_2)
+
+    def test_contact_final_child(self):
+        from lucterios.contacts.models import AbstractContact
+        create_jack(firstname="jean", lastname="DUPOND")
+        self.assertEqual(['contacts.LegalEntity', 'contacts.Individual', 'contacts.Individual'],
+                         list(AbstractContact.objects.order_by('id').values_list('final_modelname', flat=True)))
+        self.assertEqual(['legalentity', 'individual'], sorted(AbstractContact.get_final_child_relations(), reverse=True))
+        with self.assertNumQueries(1):
+            contacts = AbstractContact.objects.order_by('id').with_final_child()
+            self.assertEqual(['WoldCompany', 'MISTER jack', 'DUPOND jean'], [str(contact) for contact in contacts])
+            self.assertEqual([LegalEntity, Individual, Individual], [contact.get_final_child().__class__ for contact in contacts])
+        contact = AbstractContact.objects.get(id=3)
+        self.assertIsInstance(contact.get_final_child(), Individual)
+        self.assertEqual(3, contact.get_final_child().id)
+
+    def test_legalentity_members(self):
+        jean = create_jack(firstname="jean", lastname="DUPOND")
+        paul = create_jack(firstname="paul", lastname="DURAND", with_email=False)
+        ourdetails = LegalEntity.objects.get(id=1)
+        Responsability.objects.create(individual=Individual.objects.get(id=2), legal_entity=ourdetails)
+        Responsability.objects.create(individual=jean, legal_entity=ourdetails)
+        Responsability.objects.create(individual=paul, legal_entity=ourdetails)
+        other = LegalEntity.objects.create(name="Other", address="rue", postal_code="97250", city="LE PRECHEUR", email="other@worldcompany.com")
+        Responsability.objects.create(individual=jean, legal_entity=other)
+
+        entities = LegalEntity.load_members(list(LegalEntity.objects.all().order_by('id')))
+        with self.assertNumQueries(0):
+            self.assertEqual("jean DUPOND, jack MISTER (WoldCompany)", entities[0].get_presentation())
+            self.assertEqual(['mr-sylvestre@worldcompany.com', 'jean@worldcompany.com', 'jack@worldcompany.com'], entities[0].get_email())
+            self.assertEqual("jean DUPOND (Other)", entities[1].get_presentation())
+            self.assertEqual(['jean@worldcompany.com'], entities[1].get_email(False))
+
+    def test_custom_fields_read_only(self):
+        self._initial_custom_values()
+        jack = Individual.objects.get(id=2)
+        self.assertEqual(0, ContactCustomField.objects.filter(contact_id=2).count())
+        self.assertEqual(['', 0, 0.0, 0], [jack.custom_1, jack.custom_2, jack.custom_3, jack.custom_5])
+        self.assertEqual(0, ContactCustomField.objects.filter(contact_id=2).count())
+
+    def test_custom_fields_check_associated(self):
+        self._initial_custom_values()
+        create_jack(firstname="jean", lastname="DUPOND")
+        Individual.objects.get(id=2).set_custom_values({'custom_2': '25'})
+        progress_list = []
+        nb_created = CustomField.objects.get(id=2).check_associated(chunk_size=1, progress=lambda nb_done, nb_total: progress_list.append((nb_done, nb_total)))
+        self.assertEqual(2, nb_created)
+        self.assertEqual([(1, 2), (2, 2)], progress_list)
+        self.assertEqual(['0', '25', '0'], list(ContactCustomField.objects.filter(field_id=2).order_by('contact_id').values_list('value', flat=True)))
+        self.assertEqual(0, CustomField.objects.get(id=2).check_associated())
+        self.assertEqual(3, ContactCustomField.objects.filter(field_id=2).count())
+
+    def test_custom_import_buffer(self):
+        self._initial_custom_values()
+        Individual.initialize_import()
+        Individual._append_custom_import(Individual.objects.get(id=2), {'custom_2': '25'})
+        other_buffers = []
+        other_thread = Thread(target=lambda: other_buffers.append(getattr(Individual._custom_imports, 'contacts.Individual', None)))
+        other_thread.start()
+        other_thread.join()
+        self.assertEqual([None], other_buffers)
+        self.assertEqual(0, ContactCustomField.objects.filter(contact_id=2, field_id=2).count())
+        Individual.finalize_import()
+        self.assertEqual(None, getattr(Individual._custom_imports, 'contacts.Individual'))
+        self.assertEqual(['25'], list(ContactCustomField.objects.filter(contact_id=2, field_id=2).values_list('value', flat=True)))
+
+    def test_custom_fields_registry(self):
+        self._initial_custom_values()
+        self.assertEqual(['custom_1', 'custom_2', 'custom_3', 'custom_5', 'custom_6'], [cf_name for cf_name, _cf_model in CustomField.get_fields(Individual)])
+        self.assertEqual(['custom_1', 'custom_2', 'custom_3', 'custom_4', 'custom_7'], [cf_name for cf_name, _cf_model in CustomField.get_fields(LegalEntity)])
+        self.assertEqual('eee', CustomFieldRegistry.get_field(5).name)
+        CustomFieldRegistry.get_field(5).name = 'changed'
+        self.assertEqual('eee', CustomFieldRegistry.get_field(5).name)
+
+        CustomField.objects.get(id=5).delete()
+        self.assertEqual(['custom_1', 'custom_2', 'custom_3', 'custom_6'], [cf_name for cf_name, _cf_model in CustomField.get_fields(Individual)])
+        with self.assertRaises(CustomField.DoesNotExist):
+            CustomFieldRegistry.get_field(5)
+
+        CustomField.objects.bulk_create([CustomField(name='hhh', modelname='contacts.Individual', kind=0, args="{'multi':False, 'min':0, 'max':0, 'prec':0, 'list':[]}", order_key=8)])
+        CustomFieldRegistry.invalidate()
+        self.assertEqual(['custom_1', 'custom_2', 'custom_3', 'custom_6', 'custom_8'], [cf_name for cf_name, _cf_model in CustomField.get_fields(Individual)])
+
+        cf_model = CustomFieldRegistry.get_field(6)
+        self.assertIs(cf_model.get_args(), cf_model.get_args())
+        self.assertEqual(True, cf_model.get_args()['multi'])
+
+        dep_field = Individual.get_field_by_name('custom_3')
+        self.assertEqual(('ccc', 'custom_3'), (dep_field.verbose_name, dep_field.name))
+        self.assertEqual('custom_7', CustomFieldRegistry.get_virtualfield(7).name)
+        with self.assertRaises(CustomField.DoesNotExist):
+            CustomFieldRegistry.get_virtualfield(5)
+
+        version = CustomFieldRegistry._get_version()
+        CustomField.objects.get(id=6).save()
+        self.assertNotEqual(version, CustomFieldRegistry._get_version())
+        version = CustomFieldRegistry._get_version()
+        CustomField.objects.get(id=8).delete()
+        self.assertNotEqual(version, CustomFieldRegistry._get_version())
+
+    def test_custom_fields_args(self):
+        args = CustomFieldArgs.parse("{'multi':False,'min':-10.0, 'max':10.0, 'prec':1, 'list':['U','V']}")
+        self.assertEqual((-10.0, 10.0, 1, ('U', 'V'), False, False), args)
+        self.assertEqual(1, args['prec'])
+        self.assertEqual(('U', 'V'), args['list'])
+        self.assertEqual(args, CustomFieldArgs.parse(args.to_text()))
+        self.assertEqual((0, 0, 0, (), True, False), CustomFieldArgs.parse("{'multi':True}"))
+        self.assertEqual((0, 0, 0, (), False, False), CustomFieldArgs.parse("__import__('os').getcwd()"))
+        self.assertEqual((0, 0, 0, (), False, False), CustomFieldArgs.parse("{'min':'abc', 'list':'abc'"))
+
     def test_duplicate_merge(self):
         self._initial_custom_values()
         self.factory.xfer = AbstractContactFindDouble()
@@ -900,6 +1103,16 @@ class ContactsTest(LucteriosTest):
         self.assert_json_equal('LABELFORM', 'lastname', "MISTER")
         self.assert_json_equal('LINK', 'email', "jack@worldcompany.com")
 
+    def test_merge_custom_values(self):
+        self._initial_custom_values()
+        Individual.objects.get(id=2).set_custom_values({'custom_2': '25'})
+        create_jack(firstname="jean", lastname="DUPOND", custom_1="pas mal", custom_2="12")
+        main_jack = Individual.objects.get(id=2)
+        main_jack.merge_objects([Individual.objects.get(id=3)])
+        self.assertEqual([(1, 'pas mal'), (2, '25')], list(ContactCustomField.objects.filter(contact_id=2).order_by('field_id').values_list('field_id', 'value')))
+        self.assertEqual(0, ContactCustomField.objects.filter(contact_id=3).count())
+        self.assertEqual({'1': 'pas mal', '2': '25'}, Individual.objects.get(id=2).custom_data)
+
     def test_merge_legalentities(self):
         entity1 = LegalEntity.objects.create(name='entity1')
         entity2 = LegalEntity.objects.create(name='entity2')
@@ -44,6 +44,10 @@ class ContactSelection(XferSavedCriteriaSearchEditor):
     select_class = None
     final_class = None
 
+    def filter_items(self):
+        XferSavedCriteriaSearchEditor.filter_items(self)
+        self.items = self.items.with_final_child()
+
     def fillresponse(self):
         self.action_list = []
         if self.final_class is not None:
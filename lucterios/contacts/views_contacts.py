@@ -115,6 +115,9 @@ class LegalEntityList(XferListEditor):
         XferListEditor.__init__(self, **kwargs)
         self.size_by_page = Params.getvalue("contacts-size-page")
 
+    def get_items_from_filter(self):
+        return XferListEditor.get_items_from_filter(self).with_custom_fields()
+
     def fillresponse_header(self):
         self.fill_from_model(0, 2, False, ['structure_type'])
         obj_strtype = self.get_components('structure_type')
@@ -137,6 +140,9 @@ class LegalEntityListing(XferPrintListing):
     model = LegalEntity
     field_id = 'legal_entity'
 
+    def filter_callback(self, items):
+        return XferPrintListing.filter_callback(self, items).with_custom_fields()
+
     def get_filter(self):
         structure_type = self.getparam('structure_type')
         if (structure_type is not None) and (structure_type != '0'):
@@ -154,6 +160,9 @@ class LegalEntityLabel(XferPrintLabel):
     model = LegalEntity
     field_id = 'legal_entity'
 
+    def filter_callback(self, items):
+        return XferPrintLabel.filter_callback(self, items).with_custom_fields()
+
     def get_filter(self):
         structure_type = self.getparam('structure_type')
         if (structure_type is not None) and (structure_type != '0'):
@@ -233,6 +242,9 @@ class IndividualList(XferListEditor):
         XferListEditor.__init__(self, **kwargs)
         self.size_by_page = Params.getvalue("contacts-size-page")
 
+    def get_items_from_filter(self):
+        return XferListEditor.get_items_from_filter(self).with_custom_fields()
+
     def fillresponse_header(self):
         name_filter = self.getparam('filter')
         if name_filter is None:
@@ -262,6 +274,9 @@ class IndividualLabel(XferPrintLabel):
     model = Individual
     field_id = 'individual'
 
+    def filter_callback(self, items):
+        return XferPrintLabel.filter_callback(self, items).with_custom_fields()
+
     def get_filter(self):
         name_filter = self.getparam('filter')
         if (name_filter is not None) and (name_filter != ""):
@@ -280,6 +295,9 @@ class IndividualListing(XferPrintListing):
     field_id = 'individual'
     with_text_export = True
 
+    def filter_callback(self, items):
+        return XferPrintListing.filter_callback(self, items).with_custom_fields()
+
     def get_filter(self):
         name_filter = self.getparam('filter')
         if (name_filter is not None) and (name_filter != ""):
@@ -486,6 +504,9 @@ class AbstractContactFindDouble(XferListEditor):
     readonly = True
     methods_allowed = ('POST', 'PUT')
 
+    def get_items_from_filter(self):
+        return XferListEditor.get_items_from_filter(self).with_final_child()
+
     def fillresponse_header(self):
         self.filter = self.model.get_query_for_duplicate()
 
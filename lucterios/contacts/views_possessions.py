@@ -103,6 +103,9 @@ class PossessionList(XferListEditor):
     field_id = 'possession'
     caption = _("Possession")
 
+    def get_items_from_filter(self):
+        return XferListEditor.get_items_from_filter(self).with_custom_fields()
+
 
 @MenuManage.describ(right_to_possession_list, FORMTYPE_NOMODAL, "contact.possessions", _('To find a possession following a set of criteria.'))
 class PossessionSearch(XferSavedCriteriaSearchEditor):
@@ -85,14 +85,14 @@ class MessageEditor(LucteriosEditor):
     def _remove_cmp(self, xfer, compid):
         if compid == 0:
             xfer.remove_component('contact_nb')
-        if (xfer.item.message_type == 1) or (len(self.item.get_email_contacts(False)) == 0) or not will_mail_send():
+        if (xfer.item.message_type == 1) or not will_mail_send() or (self.item.get_contact_noemail_nb() == 0):
             xfer.remove_component('contact_noemail')
-        if (xfer.item.message_type == 0) or (len(self.item.get_sms_contacts(False)) == 0) or not AbstractProvider.is_current_active():
+        if (xfer.item.message_type == 0) or not AbstractProvider.is_current_active() or (self.item.get_contact_nosms_nb() == 0):
             xfer.remove_component('contact_nosms')
-        xfer.remove_component('recipients')
+        xfer.remove_component('recipients_count')
 
     def _manage_recipients(self, xfer):
-        obj_recipients = xfer.get_components('recipients')
+        obj_recipients = xfer.get_components('recipients_count')
         new_recipients = XferCompGrid('recipient_list')
         new_recipients.tab = obj_recipients.tab
         new_recipients.set_location(obj_recipients.col, obj_recipients.row, obj_recipients.colspan)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.mailing package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+import asyncio
+import ssl
+from base64 import b64encode
+from re import compile as re_compile
+from socket import getfqdn
+from email.message import Message
+from threading import Thread
+from smtplib import SMTPServerDisconnected, SMTPResponseException, SMTPConnectError, SMTPHeloError, SMTPNotSupportedError,\
+    SMTPAuthenticationError, SMTPSenderRefused, SMTPRecipientsRefused, SMTPDataError, quoteaddr
+
+from django.utils.translation import gettext_lazy as _
+
+from lucterios.mailing.email_functions import SMTP_SECURITY_STARTTLS, SMTP_SECURITY_SSLTTL, EmailException, SMTPSession, SMTPSessionPool,\
+    prepare_email
+
+CRLF = b"\r\n"
+EOLS_REGEX = re_compile(r'(?:\r\n|\n|\r(?!\n))')
+PERIODS_REGEX = re_compile(br'(?m)^\.')
+
+
+class AsyncSMTPClient(object):
+
+    def __init__(self, smtp_security, smtp_server, smtp_port, smtp_user, smtp_pass, timeout=60):
+        self.smtp_security = smtp_security
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.smtp_user = smtp_user
+        self.smtp_pass = smtp_pass
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.features = {}
+
+    @property
+    def pipelining(self):
+        return 'pipelining' in self.features
+
+    async def read_reply(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                self.writer = None
+                raise SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return int(line[:3]), b"\n".join(lines)
+
+    async def write_commands(self, *commands):
+        self.writer.write(b"".join([command.encode('ascii') + CRLF for command in commands]))
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def command(self, command):
+        await self.write_commands(command)
+        return await self.read_reply()
+
+    async def ehlo(self):
+        code, resp = await self.command("EHLO %s" % getfqdn())
+        self.features = {}
+        if code == 250:
+            for line in resp.decode('ascii', 'replace').split('\n')[1:]:
+                feature = line.split(' ', 1)
+                self.features[feature[0].lower()] = feature[1] if len(feature) > 1 else ''
+        else:
+            code, resp = await self.command("HELO %s" % getfqdn())
+            if code != 250:
+                raise SMTPHeloError(code, resp)
+
+    async def login(self):
+        if 'auth' not in self.features:
+            raise SMTPNotSupportedError("SMTP AUTH extension not supported by server.")
+        if 'PLAIN' in self.features['auth'].upper().split():
+            code, resp = await self.command("AUTH PLAIN %s" % b64encode(("\0%s\0%s" % (self.smtp_user, self.smtp_pass)).encode('utf-8')).decode('ascii'))
+        else:
+            code, resp = await self.command("AUTH LOGIN")
+            if code == 334:
+                code, resp = await self.command(b64encode(self.smtp_user.encode('utf-8')).decode('ascii'))
+            if code == 334:
+                code, resp = await self.command(b64encode(self.smtp_pass.encode('utf-8')).decode('ascii'))
+        if code not in (235, 503):
+            raise SMTPAuthenticationError(code, resp)
+
+    async def connect(self):
+        ssl_context = ssl.create_default_context() if self.smtp_security == SMTP_SECURITY_SSLTTL else None
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.smtp_server, self.smtp_port, ssl=ssl_context), self.timeout)
+        code, resp = await self.read_reply()
+        if code != 220:
+            await self.close()
+            raise SMTPConnectError(code, resp)
+        await self.ehlo()
+        if self.smtp_security == SMTP_SECURITY_STARTTLS:
+            if 'starttls' not in self.features:
+                raise SMTPNotSupportedError("STARTTLS extension not supported by server.")
+            code, resp = await self.command("STARTTLS")
+            if code != 220:
+                raise SMTPResponseException(code, resp)
+            await self.writer.start_tls(ssl.create_default_context(), server_hostname=self.smtp_server)
+            await self.ehlo()
+        if (self.smtp_pass != '') and (self.smtp_user != ''):
+            await self.login()
+        with SMTPSession.handshake_lock:
+            SMTPSession.handshake_count += 1
+
+    async def rset(self):
+        try:
+            await self.command("RSET")
+        except (SMTPServerDisconnected, OSError, asyncio.TimeoutError):
+            self.writer = None
+
+    async def sendmail(self, from_addr, to_addrs, msg):
+        if isinstance(msg, Message):
+            msg = msg.as_string()
+        if isinstance(msg, str):
+            msg = EOLS_REGEX.sub('\r\n', msg).encode('ascii')
+        commands = ["MAIL FROM:%s" % quoteaddr(from_addr)] + ["RCPT TO:%s" % quoteaddr(to_addr) for to_addr in to_addrs]
+        if self.pipelining:
+            await self.write_commands(*commands)
+            replies = [await self.read_reply() for _command in commands]
+        else:
+            replies = [await self.command(commands[0])]
+            if replies[0][0] == 250:
+                for command in commands[1:]:
+                    replies.append(await self.command(command))
+        code, resp = replies[0]
+        if code != 250:
+            if code == 421:
+                await self.close()
+            else:
+                await self.rset()
+            raise SMTPSenderRefused(code, resp, from_addr)
+        senderrs = {}
+        for to_addr, (code, resp) in zip(to_addrs, replies[1:]):
+            if code not in (250, 251):
+                senderrs[to_addr] = (code, resp)
+            if code == 421:
+                await self.close()
+                raise SMTPRecipientsRefused(senderrs)
+        if len(senderrs) == len(to_addrs):
+            await self.rset()
+            raise SMTPRecipientsRefused(senderrs)
+        code, resp = await self.command("DATA")
+        if code != 354:
+            await self.rset()
+            raise SMTPDataError(code, resp)
+        data = PERIODS_REGEX.sub(b'..', msg)
+        if data[-2:] != CRLF:
+            data += CRLF
+        self.writer.write(data + b"." + CRLF)
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+        code, resp = await self.read_reply()
+        if code != 250:
+            if code == 421:
+                await self.close()
+            else:
+                await self.rset()
+            raise SMTPDataError(code, resp)
+        return senderrs
+
+    async def close(self):
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            try:
+                writer.write(b"QUIT" + CRLF)
+                await asyncio.wait_for(writer.drain(), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                pass
+            writer.close()
+
+
+class AsyncSMTPSession(object):
+
+    def __init__(self, smtp_config, max_messages=SMTPSession.MAX_MESSAGES):
+        self.smtp_config = smtp_config
+        self.max_messages = max_messages
+        self.client = None
+        self.nb_sent = 0
+
+    async def get_client(self):
+        if (self.client is not None) and ((self.client.writer is None) or (self.nb_sent >= self.max_messages)):
+            await self.close()
+        if self.client is None:
+            client = AsyncSMTPClient(*self.smtp_config)
+            try:
+                await client.connect()
+            except EmailException:
+                raise
+            except Exception as error:
+                await client.close()
+                raise EmailException(str(error))
+            self.client = client
+            self.nb_sent = 0
+        return self.client
+
+    async def sendmail(self, from_addr, to_addrs, msg):
+        try:
+            result = await (await self.get_client()).sendmail(from_addr, to_addrs, msg)
+        except Exception as error:
+            if not (isinstance(error, asyncio.TimeoutError) or SMTPSession.must_reconnect(error)):
+                raise
+            await self.close()
+            result = await (await self.get_client()).sendmail(from_addr, to_addrs, msg)
+        self.nb_sent += 1
+        return result
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+
+class AsyncSMTPPool(object):
+
+    def __init__(self, nb_connection, max_messages=SMTPSession.MAX_MESSAGES):
+        session = SMTPSession.from_params(max_messages)
+        self.smtp_config = (session.smtp_security, session.smtp_server, session.smtp_port, session.smtp_user, session.smtp_pass)
+        self.nb_connection = nb_connection
+        self.max_messages = max_messages
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.sessions = asyncio.run_coroutine_threadsafe(self._create_sessions(), self.loop).result()
+
+    @classmethod
+    def is_supported(cls, smtp_security):
+        return (smtp_security != SMTP_SECURITY_STARTTLS) or hasattr(asyncio.StreamWriter, 'start_tls')
+
+    @classmethod
+    def create(cls, nb_connection, max_messages=SMTPSession.MAX_MESSAGES):
+        from lucterios.CORE.parameters import Params
+        if cls.is_supported(Params.getvalue('mailing-smtpsecurity')):
+            return cls(nb_connection, max_messages)
+        return SMTPSessionPool(nb_connection, max_messages)
+
+    async def _create_sessions(self):
+        sessions = asyncio.Queue()
+        for _idx in range(self.nb_connection):
+            sessions.put_nowait(AsyncSMTPSession(self.smtp_config, self.max_messages))
+        return sessions
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def _submit_with_session(self, msg_from, recipients, msg_content):
+        session = await self.sessions.get()
+        try:
+            return await session.sendmail(msg_from, recipients, msg_content)
+        except EmailException:
+            raise
+        except Exception as error:
+            raise EmailException(str(error) if len(recipients) > 0 else _('No valid recipients !'))
+        finally:
+            self.sessions.put_nowait(session)
+
+    def submit(self, msg_from, recipients, msg_content):
+        return asyncio.run_coroutine_threadsafe(self._submit_with_session(msg_from, recipients, msg_content), self.loop)
+
+    async def _close_sessions(self):
+        for _idx in range(self.nb_connection):
+            session = await self.sessions.get()
+            await session.close()
+
+    def close(self):
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._close_sessions(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
+
+
+def send_email(recipients, subject, body, files=None, cclist=None, bcclist=None, withcopy=False, body_txt=None):
+    msg_from, recipients, msg_content = prepare_email(recipients, subject, body, files, cclist, bcclist, withcopy, body_txt)
+    with AsyncSMTPPool.create(1) as pool:
+        return pool.submit(msg_from, recipients, msg_content).result()
@@ -25,14 +25,21 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 
 from email.mime.text import MIMEText
-from smtplib import SMTP, SMTP_SSL
+from smtplib import SMTP, SMTP_SSL, SMTPException, SMTPServerDisconnected, SMTPResponseException, SMTPSenderRefused,\
+    SMTPRecipientsRefused, SMTPDataError
 from html2text import HTML2Text
-from os.path import isfile
-from re import findall
+from os.path import isfile, getmtime
+from re import findall, split as re_split, escape as re_escape
+from threading import Lock
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 
 from email.utils import formatdate, make_msgid
+from email.message import Message
+from email.generator import Generator
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
+from email.mime.base import MIMEBase
 
 from django.utils.translation import gettext_lazy as _
 
@@ -42,6 +49,9 @@ SMTP_SECURITY_NONE = 0
 SMTP_SECURITY_STARTTLS = 1
 SMTP_SECURITY_SSLTTL = 2
 
+SMTP_ENGINE_STANDARD = 0
+SMTP_ENGINE_ASYNC = 1
+
 
 class EmailException(LucteriosException):
 
@@ -66,6 +76,20 @@ def split_doubled_email(email_list):
         return None
 
 
+class CompiledTemplate(object):
+
+    def __init__(self, text, tags):
+        self.parts = re_split('(%s)' % '|'.join([re_escape(tag) for tag in tags]), text)
+
+    def __contains__(self, tag):
+        return tag in self.parts[1::2]
+
+    def render(self, values):
+        parts = list(self.parts)
+        parts[1::2] = [values[tag] for tag in parts[1::2]]
+        return "".join(parts)
+
+
 def get_email_server(smtp_security, smtp_server, smtp_port, smtp_user, smtp_pass):
     server = None
     try:
@@ -79,9 +103,199 @@ def get_email_server(smtp_security, smtp_server, smtp_port, smtp_user, smtp_pass
             server.login(smtp_user, smtp_pass)
     except Exception as error:
         raise EmailException(str(error))
+    with SMTPSession.handshake_lock:
+        SMTPSession.handshake_count += 1
     return server
 
 
+class SMTPSession(object):
+    MAX_MESSAGES = 100
+
+    handshake_count = 0
+    handshake_lock = Lock()
+
+    def __init__(self, smtp_security, smtp_server, smtp_port, smtp_user, smtp_pass, max_messages=MAX_MESSAGES):
+        self.smtp_security = smtp_security
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.smtp_user = smtp_user
+        self.smtp_pass = smtp_pass
+        self.max_messages = max_messages
+        self.server = None
+        self.nb_sent = 0
+
+    @classmethod
+    def from_params(cls, max_messages=MAX_MESSAGES):
+        from lucterios.CORE.parameters import Params
+        return cls(Params.getvalue('mailing-smtpsecurity'), Params.getvalue('mailing-smtpserver'), Params.getvalue('mailing-smtpport'),
+                   Params.getvalue('mailing-smtpuser'), Params.getvalue('mailing-smtppass'), max_messages)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_server(self):
+        if (self.server is not None) and (self.nb_sent >= self.max_messages):
+            self.close()
+        if self.server is None:
+            self.server = get_email_server(self.smtp_security, self.smtp_server, self.smtp_port, self.smtp_user, self.smtp_pass)
+            self.nb_sent = 0
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (SMTPException, OSError):
+                self.server.close()
+            self.server = None
+
+    @classmethod
+    def must_reconnect(cls, error):
+        if isinstance(error, SMTPServerDisconnected):
+            return True
+        if isinstance(error, SMTPResponseException):
+            return error.smtp_code == 421
+        return isinstance(error, OSError) and not isinstance(error, SMTPException)
+
+    def _sendmail(self, from_addr, to_addrs, msg):
+        if isinstance(msg, Message):
+            return stream_email(self.get_server(), from_addr, to_addrs, msg)
+        else:
+            return self.get_server().sendmail(from_addr, to_addrs, msg)
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        try:
+            result = self._sendmail(from_addr, to_addrs, msg)
+        except Exception as error:
+            if not self.must_reconnect(error):
+                raise
+            if self.server is not None:
+                try:
+                    self.server.close()
+                except OSError:
+                    pass
+                self.server = None
+            result = self._sendmail(from_addr, to_addrs, msg)
+        self.nb_sent += 1
+        return result
+
+
+class SMTPDataWriter(object):
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, send, chunk_size=CHUNK_SIZE):
+        self.send = send
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.size = 0
+        self.line_start = True
+
+    def write(self, text):
+        if text == '':
+            return
+        if self.line_start and (text[0] == '.'):
+            text = '.' + text
+        text = text.replace('\n.', '\n..')
+        self.line_start = (text[-1] == '\n')
+        data = text.encode('ascii')
+        while len(data) > 0:
+            chunk = data[:self.chunk_size - self.size]
+            data = data[len(chunk):]
+            self.buffer.append(chunk)
+            self.size += len(chunk)
+            if self.size >= self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        if self.size > 0:
+            self.send(b''.join(self.buffer))
+        self.buffer = []
+        self.size = 0
+
+    def close(self):
+        if not self.line_start:
+            self.write('\r\n')
+        self.buffer.append(b'.\r\n')
+        self.size += 3
+        self.flush()
+
+
+def stream_email(server, from_addr, to_addrs, msg, chunk_size=SMTPDataWriter.CHUNK_SIZE):
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server.rset()
+        raise SMTPSenderRefused(code, resp, from_addr)
+    senderrs = {}
+    for to_addr in to_addrs:
+        code, resp = server.rcpt(to_addr)
+        if code not in (250, 251):
+            senderrs[to_addr] = (code, resp)
+        if code == 421:
+            server.close()
+            raise SMTPRecipientsRefused(senderrs)
+    if len(senderrs) == len(to_addrs):
+        server.rset()
+        raise SMTPRecipientsRefused(senderrs)
+    server.putcmd("data")
+    code, resp = server.getreply()
+    if code != 354:
+        server.rset()
+        raise SMTPDataError(code, resp)
+    try:
+        data_writer = SMTPDataWriter(server.send, chunk_size)
+        Generator(data_writer, mangle_from_=False, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+        data_writer.close()
+    except Exception:
+        server.close()
+        raise
+    code, resp = server.getreply()
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server.rset()
+        raise SMTPDataError(code, resp)
+    return senderrs
+
+
+class SMTPSessionPool(object):
+
+    def __init__(self, nb_connection, max_messages=SMTPSession.MAX_MESSAGES):
+        self.nb_connection = nb_connection
+        self.sessions = Queue()
+        for _idx in range(nb_connection):
+            self.sessions.put(SMTPSession.from_params(max_messages))
+        self.executor = ThreadPoolExecutor(max_workers=nb_connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit_with_session(self, msg_from, recipients, msg_content):
+        session = self.sessions.get()
+        try:
+            return submit_email(session, msg_from, recipients, msg_content)
+        finally:
+            self.sessions.put(session)
+
+    def submit(self, msg_from, recipients, msg_content):
+        return self.executor.submit(self._submit_with_session, msg_from, recipients, msg_content)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while not self.sessions.empty():
+            self.sessions.get().close()
+
+
 def _create_msg(recipients, subject, cclist, bcclist):
     msg = MIMEMultipart()
     msg['Date'] = formatdate(localtime=True)
@@ -103,23 +317,63 @@ def _create_msg(recipients, subject, cclist, bcclist):
     return msg
 
 
-def _append_dkim_signature(msg, domain, dkim_private_path, dkim_selector):
-    import dkim
-    with open(dkim_private_path) as dkim_private_file:
-        privateKey = dkim_private_file.read()
-    headers = [b'from', b'to', b'subject']
-    sig = dkim.sign(msg.as_string().encode(), dkim_selector.encode(), domain.encode(), privateKey.encode(), include_headers=headers)
-    sig = sig.decode()
-    msg['DKIM-Signature'] = sig[len("DKIM-Signature: "):]
+class DKIMSigner(object):
+    HEADERS = [b'from', b'to', b'subject']
+
+    _signers = {}
+    _lock = Lock()
+
+    def __init__(self, private_path, selector):
+        import dkim
+        self.dkim = dkim
+        self.private_path = private_path
+        self.mtime = getmtime(private_path)
+        with open(private_path, 'rb') as dkim_private_file:
+            self.private_key = dkim_private_file.read()
+        self.selector = selector.encode()
+
+    @classmethod
+    def get_signer(cls, private_path, selector):
+        if (private_path == '') or (selector == '') or not isfile(private_path):
+            return None
+        with cls._lock:
+            signer = cls._signers.get((private_path, selector))
+            if (signer is None) or (signer.mtime != getmtime(private_path)):
+                signer = cls(private_path, selector)
+                cls._signers[(private_path, selector)] = signer
+            return signer
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._signers = {}
+
+    def sign(self, msg_content, domain):
+        sig = self.dkim.sign(msg_content.encode(), self.selector, domain.encode(), self.private_key, include_headers=self.HEADERS, linesep=b'\n')
+        return sig.decode() + msg_content
+
+
+def serialize_email(msg, domain, dkim_private_path, dkim_selector):
+    signer = DKIMSigner.get_signer(dkim_private_path, dkim_selector)
+    if signer is not None:
+        return signer.sign(msg.as_string(), domain)
+    return msg
+
+
+def encode_attachment(filename, file):
+    return MIMEApplication(file.read(), Content_Disposition='attachment; filename="%s"' % filename, Name=filename)
 
 
 def _append_files(msg, files):
     if (files is not None) and (len(files) > 0):
-        for filename, file in files:
-            msg.attach(MIMEApplication(file.read(), Content_Disposition='attachment; filename="%s"' % filename, Name=filename))
+        for file_item in files:
+            if isinstance(file_item, MIMEBase):
+                msg.attach(file_item)
+            else:
+                msg.attach(encode_attachment(*file_item))
 
 
-def sending_email(recipients, sender_name, sender_email, subject, body, body_txt, files, cclist, bcclist, email_server, dkim_private_path, dkim_selector):
+def create_email(recipients, sender_name, sender_email, subject, body, body_txt, files, cclist, bcclist, dkim_private_path, dkim_selector):
     msg = _create_msg(recipients, subject, cclist, bcclist)
     domain = sender_email.split('@')[-1]
     msg_from = "%s <%s>" % (sender_name, sender_email)
@@ -142,10 +396,27 @@ def sending_email(recipients, sender_name, sender_email, subject, body, body_txt
     else:
         msg.attach(MIMEText(body, 'plain', 'utf-8'))
     _append_files(msg, files)
-    if (dkim_private_path != '') and isfile(dkim_private_path) and (dkim_selector != ''):
-        _append_dkim_signature(msg, domain, dkim_private_path, dkim_selector)
+    return msg_from, serialize_email(msg, domain, dkim_private_path, dkim_selector)
+
+
+def submit_email(session, msg_from, recipients, msg_content):
+    if session is None:
+        with SMTPSession.from_params() as single_session:
+            return submit_email(single_session, msg_from, recipients, msg_content)
     try:
-        return email_server.sendmail(msg_from, recipients, msg.as_string())
+        return session.sendmail(msg_from, recipients, msg_content)
+    except EmailException:
+        raise
+    except Exception as error:
+        raise EmailException(str(error) if len(recipients) > 0 else _('No valid recipients !'))
+
+
+def sending_email(recipients, sender_name, sender_email, subject, body, body_txt, files, cclist, bcclist, email_server, dkim_private_path, dkim_selector):
+    msg_from, msg_content = create_email(recipients, sender_name, sender_email, subject, body, body_txt, files, cclist, bcclist, dkim_private_path, dkim_selector)
+    if isinstance(msg_content, Message):
+        msg_content = msg_content.as_string()
+    try:
+        return email_server.sendmail(msg_from, recipients, msg_content)
     except Exception as error:
         raise EmailException(str(error) if len(recipients) > 0 else _('No valid recipients !'))
     finally:
@@ -153,13 +424,10 @@ def sending_email(recipients, sender_name, sender_email, subject, body, body_txt
             email_server.quit()
 
 
-def send_email(recipients, subject, body, files=None, cclist=None, bcclist=None, withcopy=False, body_txt=None):
+def prepare_email(recipients, subject, body, files=None, cclist=None, bcclist=None, withcopy=False, body_txt=None):
     from lucterios.CORE.parameters import Params
     from lucterios.contacts.models import LegalEntity
     smtp_server = Params.getvalue('mailing-smtpserver')
-    smtp_port = Params.getvalue('mailing-smtpport')
-    smtp_user = Params.getvalue('mailing-smtpuser')
-    smtp_pass = Params.getvalue('mailing-smtppass')
     smtp_security = Params.getvalue('mailing-smtpsecurity')
     sender_obj = LegalEntity.objects.get(id=1)
     sender_name = sender_obj.name
@@ -178,8 +446,13 @@ def send_email(recipients, subject, body, files=None, cclist=None, bcclist=None,
             bcclist = []
         if sender_email not in bcclist:
             bcclist.append(sender_email)
-    email_server = get_email_server(smtp_security, smtp_server, smtp_port, smtp_user, smtp_pass)
-    return sending_email(recipients, sender_name, sender_email, subject, body, body_txt, files, cclist, bcclist, email_server, dkim_private_path, dkim_selector)
+    msg_from, msg_content = create_email(recipients, sender_name, sender_email, subject, body, body_txt, files, cclist, bcclist, dkim_private_path, dkim_selector)
+    return msg_from, recipients, msg_content
+
+
+def send_email(recipients, subject, body, files=None, cclist=None, bcclist=None, withcopy=False, body_txt=None, session=None):
+    msg_from, recipients, msg_content = prepare_email(recipients, subject, body, files, cclist, bcclist, withcopy, body_txt)
+    return submit_email(session, msg_from, recipients, msg_content)
 
 
 def send_connection_by_email(recipients, login, passwd):
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Split message recipients into rows
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_recipients(apps, schema_editor):
+    message_model = apps.get_model("mailing", "Message")
+    recipient_model = apps.get_model("mailing", "MessageRecipient")
+    new_recipients = []
+    for message in message_model.objects.exclude(recipients=''):
+        for item in message.recipients.split('\n'):
+            if item.startswith('# fieldnames: '):
+                message.phone_field_names = item[14:]
+                message.save(update_fields=['phone_field_names'])
+            elif (item != '') and not item.startswith('# '):
+                item_splited = item.split(' ')
+                new_recipients.append(recipient_model(message=message, modelname=item_splited[0], criteria=" ".join(item_splited[1:])))
+    recipient_model.objects.bulk_create(new_recipients, batch_size=500)
+
+
+def join_recipients(apps, schema_editor):
+    message_model = apps.get_model("mailing", "Message")
+    recipient_model = apps.get_model("mailing", "MessageRecipient")
+    for message in message_model.objects.all():
+        recipients = ""
+        if message.phone_field_names != '':
+            recipients += '# fieldnames: %s\n' % message.phone_field_names
+        for recipient in recipient_model.objects.filter(message=message).order_by('id'):
+            recipients += recipient.modelname + ' ' + recipient.criteria + "\n"
+        if recipients != '':
+            message.recipients = recipients
+            message.save(update_fields=['recipients'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0010_messageline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageRecipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelname', models.CharField(max_length=100, verbose_name='model')),
+                ('criteria', models.TextField(default='', verbose_name='criteria')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mailing.message', verbose_name='message')),
+            ],
+            options={
+                'verbose_name': 'recipient',
+                'verbose_name_plural': 'recipients',
+                'ordering': ['id'],
+                'default_permissions': [],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='phone_field_names',
+            field=models.TextField(default='', verbose_name='phone fields'),
+        ),
+        migrations.RunPython(split_recipients, join_recipients),
+        migrations.RemoveField(
+            model_name='message',
+            name='recipients',
+        ),
+    ]
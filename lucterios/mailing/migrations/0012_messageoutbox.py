@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Move pending deliveries into the outbox table
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def move_email_to_send(apps, schema_editor):
+    message_model = apps.get_model("mailing", "Message")
+    outbox_model = apps.get_model("mailing", "MessageOutbox")
+    for message in message_model.objects.filter(status=2).exclude(email_to_send=''):
+        new_outbox = []
+        printmodel_name = {}
+        for sending_item in message.email_to_send.split('\n'):
+            sending_det = sending_item.split(':')
+            if (len(sending_det) == 2) and sending_det[0].isdigit():
+                new_outbox.append(outbox_model(message=message, contact_id=int(sending_det[0]), email=sending_det[1]))
+            elif len(sending_det) == 3:
+                new_outbox.append(outbox_model(message=message, email=sending_item))
+                printmodel_name[sending_det[0]] = sending_det[2]
+        outbox_model.objects.bulk_create(new_outbox, batch_size=500)
+        message.email_to_send = "\n".join(["%s:0:%s" % (model_name, printmodel) for model_name, printmodel in sorted(printmodel_name.items())])
+        message.save(update_fields=['email_to_send'])
+
+
+def restore_email_to_send(apps, schema_editor):
+    message_model = apps.get_model("mailing", "Message")
+    outbox_model = apps.get_model("mailing", "MessageOutbox")
+    for message in message_model.objects.filter(status=2):
+        sending_list = []
+        for outbox in outbox_model.objects.filter(message=message).order_by('id'):
+            if outbox.contact_id is not None:
+                sending_list.append("%d:%s" % (outbox.contact_id, outbox.email))
+            else:
+                sending_list.append(outbox.email)
+        message.email_to_send = "\n".join(sending_list)
+        message.save(update_fields=['email_to_send'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0012_abstractcontact_final_modelname'),
+        ('mailing', '0011_messagerecipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=250, verbose_name='email')),
+                ('status', models.IntegerField(choices=[(0, 'waiting'), (1, 'claimed')], default=0, verbose_name='status')),
+                ('attempts', models.IntegerField(default=0, verbose_name='attempts')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='next attempt')),
+                ('contact', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='contacts.abstractcontact', verbose_name='contact')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mailing.message', verbose_name='message')),
+            ],
+            options={
+                'verbose_name': 'outbox',
+                'verbose_name_plural': 'outbox',
+                'ordering': ['id'],
+                'default_permissions': [],
+                'indexes': [models.Index(fields=['message', 'next_attempt'], name='mailing_outbox_next_idx')],
+            },
+        ),
+        migrations.RunPython(move_email_to_send, restore_email_to_send),
+    ]
@@ -23,18 +23,29 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from datetime import date
+from datetime import date, timedelta
 from html2text import HTML2Text
 from logging import getLogger, DEBUG
 from _io import BytesIO
+from hashlib import sha1
+from array import array
+from types import SimpleNamespace
+from os import listdir, replace, unlink
+from os.path import join, dirname, getmtime, isfile
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 import json
 
 from django.utils.translation import gettext_lazy as _
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, connection, connections
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models.query import QuerySet
 from django.apps import apps
 from django_fsm import FSMIntegerField, transition
 from django.utils import timezone
+from django.core.cache import cache
 
 from lucterios.framework.models import LucteriosModel
 from lucterios.framework.model_fields import LucteriosVirtualField,\
@@ -44,16 +55,19 @@ from lucterios.framework.printgenerators import ReportingGenerator
 from lucterios.framework.tools import toHtml, get_date_formating, get_url_from_request
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.framework.error import LucteriosException, GRAVE
-from lucterios.framework.filetools import remove_accent
+from lucterios.framework.filetools import remove_accent, get_user_path
 from lucterios.framework.auditlog import auditlog
 from lucterios.framework.xferprinting import PRINT_EXT_FILE, PRINT_PDF_FILE
 from lucterios.CORE.models import Parameter, PrintModel, LucteriosGroup
 from lucterios.CORE.parameters import Params
 
-from lucterios.contacts.models import AbstractContact, CustomField
+from lucterios.contacts.models import AbstractContact, LegalEntity, CustomField, CustomFieldRegistry, ContactsChangeCounter
 from lucterios.documents.models import DocumentContainer
 from lucterios.documents.models_legacy import Document
-from lucterios.mailing.email_functions import will_mail_send, send_email, split_doubled_email
+from lucterios.mailing.email_functions import will_mail_send, split_doubled_email, prepare_email, submit_email,\
+    SMTPSession, SMTPSessionPool, CompiledTemplate, encode_attachment, SMTP_ENGINE_ASYNC
+from lucterios.mailing.email_async import AsyncSMTPPool
+from lucterios.mailing.print_render import init_render_process, render_print_file
 from lucterios.mailing.sms_functions import AbstractProvider
 
 
@@ -93,6 +107,70 @@ class MessageLineSet(QuerySet):
                 line_id += 1
 
 
+class ContactRecipients(object):
+
+    CACHE_TIMEOUT = 10 * 60
+
+    def __init__(self, querysets=(), contact_check=None, chunk_size=500, cache_key=None):
+        self.chunk_size = chunk_size
+        self.cache_key = cache_key
+        self.items = []
+        self.extend(querysets, contact_check)
+
+    def extend(self, querysets, contact_check=None):
+        for queryset in querysets:
+            self.items.append((queryset, contact_check))
+        return self
+
+    def _iter_queryset(self, queryset, contact_check):
+        for contact in queryset.iterator(chunk_size=self.chunk_size):
+            if isinstance(contact, AbstractContact):
+                contact = contact.get_final_child()
+            if (contact_check is None) or contact_check(contact):
+                yield contact
+
+    def _get_cached_ids(self, item_idx, populate=True):
+        queryset, contact_check = self.items[item_idx]
+        if (self.cache_key is None) or not issubclass(queryset.model, AbstractContact):
+            return None
+        item_key = "%s.%d" % (self.cache_key, item_idx)
+        contact_ids = cache.get(item_key)
+        if (contact_ids is None) and populate:
+            if contact_check is None:
+                contact_ids = array('q', queryset.values_list('id', flat=True).iterator(chunk_size=self.chunk_size))
+            else:
+                contact_ids = array('q', [contact.id for contact in self._iter_queryset(queryset, contact_check)])
+            cache.set(item_key, contact_ids, self.CACHE_TIMEOUT)
+        return contact_ids
+
+    def __iter__(self):
+        for item_idx, (queryset, contact_check) in enumerate(self.items):
+            contact_ids = self._get_cached_ids(item_idx)
+            if contact_ids is None:
+                for contact in self._iter_queryset(queryset, contact_check):
+                    yield contact
+            else:
+                for index in range(0, len(contact_ids), self.chunk_size):
+                    chunk_ids = list(contact_ids[index:index + self.chunk_size])
+                    contacts = dict([(contact.id, contact) for contact in AbstractContact.objects.filter(id__in=chunk_ids).with_final_child()])
+                    for contact_id in chunk_ids:
+                        if contact_id in contacts:
+                            yield contacts[contact_id].get_final_child()
+
+    def __len__(self):
+        nb_contact = 0
+        for item_idx, (queryset, contact_check) in enumerate(self.items):
+            contact_ids = self._get_cached_ids(item_idx, populate=contact_check is not None)
+            if contact_ids is not None:
+                nb_contact += len(contact_ids)
+            elif contact_check is None:
+                nb_contact += queryset.count()
+            else:
+                for _contact in self._iter_queryset(queryset, contact_check):
+                    nb_contact += 1
+        return nb_contact
+
+
 class Message(LucteriosModel):
     MESSAGE_TYPE_EMAIL = 0
     MESSAGE_TYPE_SMS = 1
@@ -107,7 +185,7 @@ class Message(LucteriosModel):
     body = models.TextField(_('body'), default="")
     message_type = FSMIntegerField(verbose_name=_('type'), default=0, choices=MESSAGE_TYPE_LIST)
     status = FSMIntegerField(verbose_name=_('status'), default=0, choices=STATUS_LIST)
-    recipients = models.TextField(_('recipients'), default="", null=False)
+    phone_field_names = models.TextField(_('phone fields'), default="", null=False)
     date = models.DateField(verbose_name=_('date'), null=True)
     contact = models.ForeignKey('contacts.AbstractContact', verbose_name=_('contact'), null=True, on_delete=models.SET_NULL)
     email_to_send = models.TextField(_('email to send'), default="")
@@ -116,6 +194,7 @@ class Message(LucteriosModel):
     attachments = models.ManyToManyField(DocumentContainer, verbose_name=_('documents'), blank=True)
     doc_in_link = models.BooleanField(_('documents in link'), null=False, default=False)
 
+    recipients_count = LucteriosVirtualField(verbose_name=_('recipients'), compute_from=lambda this: len(this.get_recipient_list()), format_string='N')
     size_sms = LucteriosVirtualField(verbose_name=_('sms size'), compute_from='get_size_sms')
     contact_nb = LucteriosVirtualField(verbose_name=_('number of recipients'), compute_from='get_contact_nb', format_string='N')
     contact_noemail = LucteriosVirtualField(verbose_name=_('without email address'), compute_from='get_contact_noemail')
@@ -126,6 +205,8 @@ class Message(LucteriosModel):
         LucteriosModel.__init__(self, *args, **kwargs)
         self._show_only_failed = False
         self._last_xfer = None
+        self._recipient_list = None
+        self._print_items = {}
 
     def set_context(self, xfer):
         self._show_only_failed = xfer.getparam('show_only_failed', False)
@@ -146,7 +227,7 @@ class Message(LucteriosModel):
     def get_show_fields(cls):
         return {'': [('status', 'date')],
                 _('001@Message'): ['subject', 'body', 'size_sms', 'sms_field_names'],
-                _('002@Recipients'): ['recipients', ('contact_nb', 'contact_noemail', 'contact_nosms')],
+                _('002@Recipients'): ['recipients_count', ('contact_nb', 'contact_noemail', 'contact_nosms')],
                 _('003@Documents'): ['attachments', (('', 'empty'),), 'doc_in_link']
                 }
 
@@ -176,6 +257,24 @@ class Message(LucteriosModel):
     def get_size_sms(self):
         return len(self.body.replace('{[br/]}', '\n'))
 
+    def get_contact_noemail_nb(self):
+        return len(self.get_email_contacts(False))
+
+    def get_contact_nosms_nb(self):
+        provider = AbstractProvider.get_current_instance()
+        if (self.message_type != self.MESSAGE_TYPE_SMS) or (provider is None):
+            return 0
+        field_names = list(self.get_sms_field_names(translate=False))
+        nb_contact = 0
+        for queryset in self.get_recipient_querysets():
+            if (len(field_names) > 0) and all([field_name in [field.name for field in queryset.model._meta.get_fields()] for field_name in field_names]):
+                for phones in queryset.values_list(*field_names).iterator(chunk_size=500):
+                    if not provider.has_valid_phone(SimpleNamespace(**dict(zip(field_names, phones))), field_names):
+                        nb_contact += 1
+            else:
+                nb_contact += len(ContactRecipients([queryset], lambda contact: not provider.has_valid_phone(contact, field_names)))
+        return nb_contact
+
     def get_contact_noemail(self):
         no_emails = self.get_email_contacts(False)
         return [str(no_email) for no_email in no_emails]
@@ -186,44 +285,63 @@ class Message(LucteriosModel):
         no_sms_list = self.get_sms_contacts(False)
         return ["%s : %s" % (no_sms, show_phones(no_sms).strip()) for no_sms in no_sms_list]
 
+    def get_recipient_filters(self):
+        recipient_filters = {}
+        contact_orders = []
+        for recipient_idx, (modelname, item) in enumerate(self.get_recipients()):
+            model = apps.get_model(modelname)
+            model_filter = item[0]
+            if issubclass(model, AbstractContact):
+                model_filter = models.Q(id__in=model.objects.filter(model_filter).values('pk'))
+                contact_orders.append(models.When(model_filter, then=models.Value(recipient_idx)))
+                model = AbstractContact
+            if model in recipient_filters:
+                recipient_filters[model] |= model_filter
+            else:
+                recipient_filters[model] = model_filter
+        return recipient_filters, contact_orders
+
+    def get_recipient_querysets(self):
+        querysets = []
+        recipient_filters, contact_orders = self.get_recipient_filters()
+        for model, model_filter in recipient_filters.items():
+            if model is AbstractContact:
+                recipient_order = models.Case(*contact_orders, output_field=models.IntegerField())
+                querysets.append(AbstractContact.objects.filter(model_filter).annotate(recipient_order=recipient_order).order_by('recipient_order', 'id').with_final_child())
+            else:
+                querysets.append(model.objects.filter(model_filter).distinct().order_by('id'))
+        return querysets
+
+    def get_recipients_cache_key(self, kind):
+        if self.id is None:
+            return None
+        recipients_text = "\n".join(["%s %s" % (recipient.modelname, recipient.criteria) for recipient in self.get_recipient_list()])
+        fingerprint = sha1(("%s\n%s" % (self.phone_field_names, recipients_text)).encode('utf-8')).hexdigest()
+        return "lucterios.mailing.recipients.%d.%s.%s.%d" % (self.id, kind, fingerprint, ContactsChangeCounter.get())
+
     def get_email_contacts(self, email=None):
-        def append_contact(new_contact):
-            if new_contact not in contact_list:
-                contact_list.append(new_contact)
-        contact_list = []
+        recipients = ContactRecipients(cache_key=self.get_recipients_cache_key("email%s" % email))
         if self.message_type == self.MESSAGE_TYPE_EMAIL:
-            for modelname, item in self.get_recipients():
-                model = apps.get_model(modelname)
-                contact_filter = item[0]
-                if (email is not None) and (model.get_field_by_name('email') is None):
-                    for contact in model.objects.filter(contact_filter).distinct():
-                        if (email is True) and hasattr(contact, 'get_email') and (contact.get_email() != []):
-                            append_contact(contact)
-                        elif (email is False) and (not hasattr(contact, 'get_email') or (contact.get_email() == [])):
-                            append_contact(contact)
-                else:
-                    if (email is not None) and (model.get_field_by_name('email') is not None):
-                        contact_filter &= ~models.Q(email='') if email else models.Q(email='')
-                    for contact in model.objects.filter(contact_filter).distinct():
-                        append_contact(contact)
-        return contact_list
+            if email is None:
+                recipients.extend(self.get_recipient_querysets())
+            else:
+                for queryset in self.get_recipient_querysets():
+                    if queryset.model.get_field_by_name('email') is not None:
+                        recipients.extend([queryset.filter(~models.Q(email='') if email else models.Q(email=''))])
+                    else:
+                        recipients.extend([queryset], lambda contact: (hasattr(contact, 'get_email') and (contact.get_email() != [])) == email)
+        return recipients
 
     def get_sms_contacts(self, sms=None):
-        contact_list = []
+        recipients = ContactRecipients(cache_key=self.get_recipients_cache_key("sms%s" % sms))
         if self.message_type == self.MESSAGE_TYPE_SMS:
             provider = AbstractProvider.get_current_instance()
-            if (sms is None) or (provider is not None):
+            if sms is None:
+                recipients.extend(self.get_recipient_querysets())
+            elif provider is not None:
                 field_names = list(self.get_sms_field_names(translate=False))
-                for modelname, item in self.get_recipients():
-                    model = apps.get_model(modelname)
-                    contact_filter = item[0]
-                    for contact in model.objects.filter(contact_filter).distinct():
-                        if (sms is None) or \
-                            ((sms is True) and provider.has_valid_phone(contact, field_names)) or \
-                                ((sms is False) and not provider.has_valid_phone(contact, field_names)):
-                            if contact not in contact_list:
-                                contact_list.append(contact)
-        return contact_list
+                recipients.extend(self.get_recipient_querysets(), lambda contact: provider.has_valid_phone(contact, field_names) == sms)
+        return recipients
 
     @property
     def recipients_description(self):
@@ -235,62 +353,83 @@ class Message(LucteriosModel):
         field_names = []
         field_names.append(('tel1', AbstractContact.get_field_by_name('tel1').verbose_name))
         field_names.append(('tel2', AbstractContact.get_field_by_name('tel2').verbose_name))
-        for cf_model in CustomField.objects.filter(kind=0):
-            if (cf_model.get_args()['multi'] is False) and issubclass(cf_model.model_associated(), AbstractContact):
+        for cf_model in CustomFieldRegistry.get_all():
+            if (cf_model.kind == CustomField.KIND_STRING) and (cf_model.get_args()['multi'] is False) and issubclass(cf_model.model_associated(), AbstractContact):
                 field_names.append((cf_model.get_fieldname(), cf_model.name))
         return field_names
 
     def get_sms_field_names(self, translate=True):
-        for item in self.recipients.split('\n'):
-            if item.startswith('# fieldnames: '):
-                for field_name in item[14:].split(';'):
-                    if translate:
-                        dep_field = AbstractContact.get_field_by_name(field_name)
-                        if dep_field is not None:
-                            field_name = dep_field.verbose_name
-                    yield field_name
-                break
+        if self.phone_field_names != '':
+            for field_name in self.phone_field_names.split(';'):
+                if translate:
+                    dep_field = AbstractContact.get_field_by_name(field_name)
+                    if dep_field is not None:
+                        field_name = dep_field.verbose_name
+                yield field_name
 
     def set_sms_field_names(self, fieldnames):
-        recipient_list = self.recipients.split('\n')
-        self.recipients = '# fieldnames: %s\n' % fieldnames
-        for item in recipient_list:
-            if (item != '') and not item.startswith('# fieldnames: '):
-                self.recipients += item + "\n"
+        self.phone_field_names = "%s" % fieldnames
         self.save()
 
+    def get_recipient_list(self):
+        if self._recipient_list is None:
+            if self.id is None:
+                self._recipient_list = []
+            else:
+                self._recipient_list = list(self.messagerecipient_set.all())
+        return self._recipient_list
+
     def get_recipients(self):
-        for item in self.recipients.split('\n'):
-            if (item != '') and not item.startswith('# '):
+        for recipient in self.get_recipient_list():
+            yield recipient.modelname, recipient.get_search_query()
+
+    @property
+    def recipients(self):
+        recipients = ""
+        if self.phone_field_names != '':
+            recipients += '# fieldnames: %s\n' % self.phone_field_names
+        new_recipients = self.__dict__.get('_new_recipients')
+        if new_recipients is None:
+            new_recipients = [(recipient.modelname, recipient.criteria) for recipient in self.get_recipient_list()]
+        for modelname, criteria in new_recipients:
+            recipients += modelname + ' ' + criteria + "\n"
+        return recipients
+
+    @recipients.setter
+    def recipients(self, value):
+        self._new_recipients = []
+        for item in value.split('\n'):
+            if item.startswith('# fieldnames: '):
+                self.phone_field_names = item[14:]
+            elif (item != '') and not item.startswith('# '):
                 item_splited = item.split(' ')
-                modelname = item_splited[0]
-                criteria = " ".join(item_splited[1:])
-                yield modelname, get_search_query_from_criteria(criteria, apps.get_model(modelname))
+                self._new_recipients.append((item_splited[0], " ".join(item_splited[1:])))
+
+    def _save_new_recipients(self):
+        new_recipients = self.__dict__.get('_new_recipients')
+        if new_recipients is not None:
+            self.messagerecipient_set.all().delete()
+            MessageRecipient.objects.bulk_create([MessageRecipient(message=self, modelname=modelname, criteria=criteria) for modelname, criteria in new_recipients])
+            self._new_recipients = None
+            self._recipient_list = None
 
     def add_recipient(self, modelname, criteria):
         if self.status == self.STATUS_OPEN:
-            self.recipients += modelname + ' ' + criteria + "\n"
-            self.save()
+            if self.id is None:
+                self.save()
+            MessageRecipient.objects.create(message=self, modelname=modelname, criteria=criteria)
+            self._recipient_list = None
 
     def del_recipient(self, recipients):
         if (self.status == self.STATUS_OPEN) and (recipients >= 0):
-            recipient_list = self.recipients.split('\n')
-            self.recipients = ""
-            list_idx = 0
-            while list_idx < len(recipient_list):
-                if recipient_list[list_idx].startswith('# '):
-                    self.recipients += recipient_list[list_idx] + "\n"
-                    del recipient_list[list_idx]
-                else:
-                    list_idx += 1
+            recipient_list = self.get_recipient_list()
             if recipients < len(recipient_list):
-                del recipient_list[recipients]
-                self.recipients += "\n".join(recipient_list)
-                self.save()
+                recipient_list[recipients].delete()
+                self._recipient_list = None
 
     transitionname__valid = _("Valid")
 
-    @transition(field=status, source=STATUS_OPEN, target=STATUS_VALIDATED, conditions=[lambda item:len(list(item.get_recipients())) > 0])
+    @transition(field=status, source=STATUS_OPEN, target=STATUS_VALIDATED, conditions=[lambda item:len(item.get_recipient_list()) > 0])
     def valid(self):
         self.date = date.today()
 
@@ -299,10 +438,11 @@ class Message(LucteriosModel):
         for last_sending_item in self.email_to_send.split('\n'):
             if len(last_sending_item.split(':')) == 3:
                 printmodel_name[last_sending_item.split(':')[0]] = last_sending_item.split(':')[2]
-        for old_emailsent in self.emailsent_set.all():
-            last_sending_item = old_emailsent.email
-            if len(last_sending_item.split(':')) == 3:
-                printmodel_name[last_sending_item.split(':')[0]] = last_sending_item.split(':')[2]
+        if len(printmodel_name) > 0:
+            return printmodel_name
+        for old_email in list(self.messageoutbox_set.filter(contact__isnull=True).values_list('email', flat=True)) + list(self.emailsent_set.values_list('email', flat=True)):
+            if len(old_email.split(':')) == 3:
+                printmodel_name[old_email.split(':')[0]] = old_email.split(':')[2]
         return printmodel_name
 
     @property
@@ -310,14 +450,18 @@ class Message(LucteriosModel):
         return len(self.get_printmodel_names()) > 0
 
     def prep_sending(self):
+        printmodel_name = {}
         if self.message_type == self.MESSAGE_TYPE_EMAIL:
+            printmodel_name = self.get_printmodel_names()
             item_list = self._prep_sending_email()
         elif self.message_type == self.MESSAGE_TYPE_SMS:
             item_list = self._prep_sending_sms()
         else:
             item_list = []
         item_list.sort()
-        self.email_to_send = "\n".join(item_list)
+        self.messageoutbox_set.all().delete()
+        MessageOutbox.objects.bulk_create([MessageOutbox.create_from_sending_item(self, sending_item) for sending_item in item_list], batch_size=500)
+        self.email_to_send = "\n".join(["%s:0:%s" % (model_name, printmodel) for model_name, printmodel in sorted(printmodel_name.items())])
         self.save()
         self.emailsent_set.all().delete()
         return len(item_list)
@@ -396,66 +540,168 @@ class Message(LucteriosModel):
             self.define_email_message()
         return self._email_content
 
+    def get_email_template(self):
+        if not hasattr(self, '_email_template'):
+            subject_template = CompiledTemplate(self.subject, EmailSent.TAG_LIST)
+            body_template = CompiledTemplate(self.email_content, EmailSent.TAG_LIST)
+            text_template = None
+            if (self.message_type == self.MESSAGE_TYPE_EMAIL) and ('#footer' not in body_template):
+                tag_markers = dict([(tag, 'LUCTERIOSTAG%dMARKER' % tag_idx) for tag_idx, tag in enumerate(EmailSent.TAG_LIST)])
+                h2txt = HTML2Text()
+                h2txt.ignore_links = False
+                body_text = h2txt.handle(body_template.render(tag_markers))
+                for tag, tag_marker in tag_markers.items():
+                    body_text = body_text.replace(tag_marker, tag)
+                text_template = CompiledTemplate(body_text, EmailSent.TAG_LIST)
+            self._email_template = (subject_template, body_template, text_template)
+        return self._email_template
+
     @property
     def attach_files(self):
         if not hasattr(self, '_attache_files'):
             self.define_email_message()
         return self._attache_files
 
+    @property
+    def encoded_attach_files(self):
+        if not hasattr(self, '_encoded_attach_files'):
+            self._encoded_attach_files = [encode_attachment(filename, file) for filename, file in self.attach_files]
+        return self._encoded_attach_files
+
+    def _load_sending_contacts(self, outbox_list):
+        contacts = {}
+        contact_ids = [outbox.contact_id for outbox in outbox_list if outbox.contact_id is not None]
+        for contact in AbstractContact.objects.filter(id__in=contact_ids).with_final_child():
+            contacts[contact.id] = contact
+        LegalEntity.load_members([contact.get_final_child() for contact in contacts.values()])
+        return contacts
+
+    def _close_sending(self):
+        if MessageOutbox.is_finished(self):
+            for outbox in self.messageoutbox_set.all():
+                EmailSent.objects.create(message=self, contact_id=outbox.contact_id, email=outbox.email, date=timezone.now(),
+                                         success=False, error=_('Sending abandoned after %d attempts') % outbox.attempts)
+            self.messageoutbox_set.all().delete()
+            self.status = self.STATUS_VALIDATED
+            self.save()
+            PrintFileCache.clean()
+
     def sendSMS(self):
         getLogger('lucterios.mailing').debug('Message.sendsms()')
         provider = AbstractProvider.get_current_instance()
         if (self.message_type == self.MESSAGE_TYPE_SMS) and (provider is not None) and provider.is_active and (self.status == self.STATUS_SENDING):
-            sms_list = self.email_to_send.split("\n")
-            for contact_sms in sms_list:
-                contact_sms_det = contact_sms.split(':')
-                if len(contact_sms_det) == 2:
-                    contact_id, sms = contact_sms_det
-                    try:
-                        contact = AbstractContact.objects.get(id=contact_id)
-                    except AbstractContact.DoesNotExist:
-                        contact = None
-                email_sent = EmailSent.objects.create(message=self, contact=contact, email=sms, date=timezone.now())
+            outbox_list = MessageOutbox.claim(self)
+            contacts = self._load_sending_contacts(outbox_list)
+            for outbox in outbox_list:
+                with transaction.atomic():
+                    email_sent = EmailSent.objects.create(message=self, contact=contacts.get(outbox.contact_id), email=outbox.email, date=timezone.now())
+                    outbox.delete()
                 email_sent.send_sms(provider)
-            self.email_to_send = ""
-            self.status = self.STATUS_VALIDATED
-            self.save()
+            self._close_sending()
         return
 
     def sendemail(self, nb_to_send, http_root_address):
         getLogger('lucterios.mailing').debug('Message.sendemail(nb_to_send=%s, http_root_address=%s)', nb_to_send, http_root_address)
         self.http_root_address = http_root_address
         if (self.message_type == self.MESSAGE_TYPE_EMAIL) and will_mail_send() and (self.status == self.STATUS_SENDING):
-            email_list = self.email_to_send.split("\n")
-            for contact_email in email_list[:nb_to_send]:
-                contact_email_det = contact_email.split(':')
-                if len(contact_email_det) == 2:
-                    contact_id, email = contact_email_det
-                    try:
-                        contact = AbstractContact.objects.get(id=contact_id)
-                    except AbstractContact.DoesNotExist:
-                        contact = None
-                elif len(contact_email_det) == 3:
-                    modelname, object_id, _printmodel = contact_email_det
-                    model = apps.get_model(modelname)
-                    item = model.objects.get(id=object_id)
-                    if hasattr(item, 'contact'):
-                        contact = item.contact
-                    elif isinstance(item, AbstractContact):
-                        contact = item
-                    else:
-                        contact = None
-                    email = contact_email
-                else:
-                    continue
-                email_sent = EmailSent.objects.create(message=self, contact=contact, email=email, date=timezone.now())
-                email_sent.send_email(http_root_address)
-            self.email_to_send = "\n".join(email_list[nb_to_send:])
-            if self.email_to_send == '':
-                self.status = self.STATUS_VALIDATED
-            self.save()
+            outbox_list = MessageOutbox.claim(self, nb_to_send)
+            contacts = self._load_sending_contacts(outbox_list)
+            self._print_items = self._prerender_print_files(outbox_list)
+            nb_connection = Params.getvalue('mailing-nb-connection')
+            if (Params.getvalue('mailing-smtp-engine') == SMTP_ENGINE_ASYNC) and (len(outbox_list) > 0):
+                with AsyncSMTPPool.create(min(nb_connection, len(outbox_list))) as pool:
+                    self._send_outbox_emails_parallel(outbox_list, contacts, http_root_address, pool)
+            elif (nb_connection > 1) and (len(outbox_list) > 1):
+                with SMTPSessionPool(min(nb_connection, len(outbox_list))) as pool:
+                    self._send_outbox_emails_parallel(outbox_list, contacts, http_root_address, pool)
+            else:
+                with SMTPSession.from_params() as session:
+                    self._send_outbox_emails(outbox_list, contacts, http_root_address, session)
+            self._close_sending()
         return
 
+    @classmethod
+    def can_render_in_process(cls):
+        if connection.in_atomic_block:
+            return False
+        return not ((connection.vendor == 'sqlite') and connection.is_in_memory_db())
+
+    def _prerender_print_files(self, outbox_list):
+        print_items = {}
+        to_render = {}
+        for email in set([outbox.email for outbox in outbox_list if outbox.contact_id is None]):
+            email_sent = EmailSent(message=self, email=email)
+            try:
+                file_path = email_sent.get_print_file_path()
+            except (LookupError, ObjectDoesNotExist):
+                continue
+            print_items[email] = email_sent.print_item
+            if (file_path is not None) and not PrintFileCache.is_valid(file_path):
+                to_render[file_path] = email
+        nb_process = min(Params.getvalue('mailing-nb-render-process'), len(to_render))
+        if (nb_process > 1) and self.can_render_in_process():
+            database_names = dict([(alias, connections[alias].settings_dict['NAME']) for alias in connections])
+            with ProcessPoolExecutor(max_workers=nb_process, mp_context=get_context('spawn'), initializer=init_render_process,
+                                     initargs=(settings.SETTINGS_MODULE, database_names)) as executor:
+                renderings = [executor.submit(render_print_file, email, file_path) for file_path, email in to_render.items()]
+                for rendering in renderings:
+                    try:
+                        rendering.result()
+                    except Exception:
+                        getLogger('lucterios.mailing').exception('render_print_file')
+        return print_items
+
+    def _hand_over_outbox(self, outbox, contacts):
+        with transaction.atomic():
+            email_sent = self._create_outbox_email_sent(outbox, contacts)
+            outbox.delete()
+        return email_sent
+
+    def _create_outbox_email_sent(self, outbox, contacts):
+        contact_email_det = outbox.email.split(':')
+        if outbox.contact_id is not None:
+            contact = contacts.get(outbox.contact_id)
+        elif len(contact_email_det) == 3:
+            print_item = self._print_items.get(outbox.email)
+            if print_item is not None:
+                item = print_item[0]
+            else:
+                modelname, object_id, _printmodel = contact_email_det
+                item = apps.get_model(modelname).objects.get(id=object_id)
+            if hasattr(item, 'contact'):
+                contact = item.contact
+            elif isinstance(item, AbstractContact):
+                contact = item
+            else:
+                contact = None
+        else:
+            return None
+        email_sent = EmailSent.objects.create(message=self, contact=contact, email=outbox.email, date=timezone.now())
+        email_sent.print_item = self._print_items.get(outbox.email)
+        return email_sent
+
+    def _send_outbox_emails(self, outbox_list, contacts, http_root_address, session):
+        for outbox in outbox_list:
+            email_sent = self._hand_over_outbox(outbox, contacts)
+            if email_sent is not None:
+                email_sent.send_email(http_root_address, session=session)
+
+    def _send_outbox_emails_parallel(self, outbox_list, contacts, http_root_address, pool):
+        sending_list = []
+        for outbox in outbox_list:
+            email_sent = self._hand_over_outbox(outbox, contacts)
+            if email_sent is None:
+                continue
+            try:
+                sending_list.append((email_sent, pool.submit(*email_sent.prepare_email(http_root_address))))
+            except Exception as error:
+                email_sent.set_email_error(error)
+        for email_sent, sending in sending_list:
+            try:
+                email_sent.set_email_result(sending.result())
+            except Exception as error:
+                email_sent.set_email_error(error)
+
     def get_email_status(self):
         if not hasattr(self, '_email_status'):
             self._email_status = json.loads(self.email_sent)
@@ -515,7 +761,9 @@ class Message(LucteriosModel):
         self.body = self.body.replace('{[p]}', '')
         self.body = self.body.replace('{[/p]}{[br/]}', '{[br]}')
         self.body = self.body.replace('{[/p]}', '{[br]}')
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        self._save_new_recipients()
+        return res
 
     class Meta(object):
         verbose_name = _('message')
@@ -523,7 +771,143 @@ class Message(LucteriosModel):
         ordering = ['-date']
 
 
+class MessageRecipient(LucteriosModel):
+    message = models.ForeignKey(Message, verbose_name=_('message'), null=False, on_delete=models.CASCADE)
+    modelname = models.CharField(_('model'), max_length=100, blank=False)
+    criteria = models.TextField(_('criteria'), default="", null=False)
+
+    def __init__(self, *args, **kwargs):
+        LucteriosModel.__init__(self, *args, **kwargs)
+        self._search_query = None
+
+    def __str__(self):
+        return "%s %s" % (self.modelname, self.criteria)
+
+    @classmethod
+    def get_default_fields(cls):
+        return ['modelname', 'criteria']
+
+    def get_auditlog_object(self):
+        return self.message
+
+    def get_search_query(self):
+        if self._search_query is None:
+            self._search_query = get_search_query_from_criteria(self.criteria, apps.get_model(self.modelname))
+        return self._search_query
+
+    class Meta(object):
+        default_permissions = []
+        verbose_name = _('recipient')
+        verbose_name_plural = _('recipients')
+        ordering = ['id']
+
+
+class MessageOutbox(LucteriosModel):
+    STATUS_WAITING = 0
+    STATUS_CLAIMED = 1
+    STATUS_LIST = ((STATUS_WAITING, _('waiting')), (STATUS_CLAIMED, _('claimed')))
+
+    MAX_ATTEMPTS = 3
+    CLAIM_DELAY = 15
+
+    message = models.ForeignKey(Message, verbose_name=_('message'), null=False, on_delete=models.CASCADE)
+    contact = models.ForeignKey('contacts.AbstractContact', verbose_name=_('contact'), null=True, on_delete=models.SET_NULL)
+    email = models.CharField(_('email'), max_length=250, blank=False)
+    status = models.IntegerField(verbose_name=_('status'), default=STATUS_WAITING, choices=STATUS_LIST)
+    attempts = models.IntegerField(verbose_name=_('attempts'), null=False, default=0)
+    next_attempt = models.DateTimeField(verbose_name=_('next attempt'), null=False, default=timezone.now)
+
+    @classmethod
+    def get_default_fields(cls):
+        return ['contact', 'email', 'status', 'attempts', 'next_attempt']
+
+    @classmethod
+    def create_from_sending_item(cls, message, sending_item):
+        sending_det = sending_item.split(':')
+        if (len(sending_det) == 2) and sending_det[0].isdigit():
+            return cls(message=message, contact_id=int(sending_det[0]), email=sending_det[1])
+        else:
+            return cls(message=message, email=sending_item)
+
+    @classmethod
+    def _get_claimable(cls, message, now):
+        return cls.objects.filter(message=message, next_attempt__lte=now, attempts__lt=cls.MAX_ATTEMPTS).order_by('id')
+
+    @classmethod
+    def claim(cls, message, nb_to_claim=None):
+        now = timezone.now()
+        claim_values = {'status': cls.STATUS_CLAIMED, 'attempts': models.F('attempts') + 1,
+                        'next_attempt': now + timedelta(minutes=cls.CLAIM_DELAY)}
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                outbox_query = cls._get_claimable(message, now).select_for_update(skip_locked=True)
+                outbox_ids = list((outbox_query[:nb_to_claim] if nb_to_claim is not None else outbox_query).values_list('id', flat=True))
+                cls.objects.filter(id__in=outbox_ids).update(**claim_values)
+        else:
+            outbox_ids = []
+            outbox_query = cls._get_claimable(message, now).values_list('id', flat=True)
+            for outbox_id in (outbox_query[:nb_to_claim] if nb_to_claim is not None else outbox_query):
+                if cls._get_claimable(message, now).filter(id=outbox_id).update(**claim_values) == 1:
+                    outbox_ids.append(outbox_id)
+        return list(cls.objects.filter(id__in=outbox_ids).order_by('id'))
+
+    @classmethod
+    def is_finished(cls, message):
+        return not cls.objects.filter(message=message).filter(models.Q(attempts__lt=cls.MAX_ATTEMPTS) | models.Q(next_attempt__gt=timezone.now())).exists()
+
+    class Meta(object):
+        verbose_name = _('outbox')
+        verbose_name_plural = _('outbox')
+        default_permissions = []
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['message', 'next_attempt'], name='mailing_outbox_next_idx'),
+        ]
+
+
+class PrintFileCache(object):
+    MAX_AGE = 24 * 60 * 60
+
+    @classmethod
+    def get_version(cls, item, printmodel_obj):
+        return sha1((str(item.get_print_version()) + printmodel_obj.value).encode()).hexdigest()
+
+    @classmethod
+    def get_path(cls, modelname, item, printmodel_obj):
+        if not hasattr(item, 'get_print_version'):
+            return None
+        key = "%s:%d:%d:%s" % (modelname, item.id, printmodel_obj.id, cls.get_version(item, printmodel_obj))
+        return get_user_path('mailing', 'printfile_%s.pdf' % sha1(key.encode()).hexdigest())
+
+    @classmethod
+    def is_valid(cls, file_path):
+        return isfile(file_path) and ((time() - getmtime(file_path)) < cls.MAX_AGE)
+
+    @classmethod
+    def read(cls, file_path):
+        if cls.is_valid(file_path):
+            with open(file_path, 'rb') as pdf_file:
+                return pdf_file.read()
+        return None
+
+    @classmethod
+    def write(cls, file_path, pdf_content):
+        with open(file_path + '.tmp', 'wb') as pdf_file:
+            pdf_file.write(pdf_content)
+        replace(file_path + '.tmp', file_path)
+
+    @classmethod
+    def clean(cls):
+        cache_dir = dirname(get_user_path('mailing', 'printfile.pdf'))
+        for file_name in listdir(cache_dir):
+            file_path = join(cache_dir, file_name)
+            if file_name.startswith('printfile_') and ((time() - getmtime(file_path)) >= cls.MAX_AGE):
+                unlink(file_path)
+
+
 class EmailSent(LucteriosModel):
+    TAG_LIST = ('#name', '#doc', '#reference', '#footer')
+
     message = models.ForeignKey(Message, verbose_name=_('message'), null=False, on_delete=models.CASCADE)
     contact = models.ForeignKey('contacts.AbstractContact', verbose_name=_('contact'), null=True, on_delete=models.SET_NULL)
     email = models.CharField(_('email'), max_length=50, blank=False)
@@ -549,24 +933,47 @@ class EmailSent(LucteriosModel):
         else:
             return self.email
 
+    def load_print_item(self):
+        if getattr(self, 'print_item', None) is None:
+            modelname, object_id, printmodel = self.email.split(':')
+            item = apps.get_model(modelname).objects.get(id=object_id)
+            if hasattr(item, "get_pdfreport"):
+                self.print_item = (item, None)
+            else:
+                self.print_item = (item, PrintModel.objects.get(id=printmodel))
+        self.item, self.printmodel_obj = self.print_item
+
+    def get_print_file_path(self):
+        if len(self.email.split(':')) != 3:
+            return None
+        self.load_print_item()
+        if self.printmodel_obj is None:
+            return None
+        return PrintFileCache.get_path(self.email.split(':')[0], self.item, self.printmodel_obj)
+
+    def generate_print_content(self):
+        gen = ReportingGenerator()
+        gen.items = self.get_send_email_objects()
+        gen.model_text = self.printmodel_obj.value
+        return gen.generate_report(None, PRINT_EXT_FILE[PRINT_PDF_FILE])
+
     def _extract_obj(self):
         if len(self.email.split(':')) == 3:
-            modelname, object_id, printmodel = self.email.split(':')
-            model = apps.get_model(modelname)
-            self.item = model.objects.get(id=object_id)
-            if hasattr(self.item, "get_pdfreport"):
-                self.print_file = [self.item.get_pdfreport(int(printmodel))]
+            self.load_print_item()
+            if self.printmodel_obj is None:
+                self.print_file = [self.item.get_pdfreport(int(self.email.split(':')[2]))]
             else:
-                printmodel_obj = PrintModel.objects.get(id=printmodel)
                 if hasattr(self.item, "get_document_filename"):
                     pdf_name = "%s.pdf" % self.item.get_document_filename()
                 else:
-                    pdf_name = "%s.pdf" % remove_accent(printmodel_obj.name)
-                gen = ReportingGenerator()
-                gen.items = self.get_send_email_objects()
-                gen.model_text = printmodel_obj.value
-                pdf_file = BytesIO(gen.generate_report(None, PRINT_EXT_FILE[PRINT_PDF_FILE]))
-                self.print_file = [(pdf_name, pdf_file)]
+                    pdf_name = "%s.pdf" % remove_accent(self.printmodel_obj.name)
+                file_path = self.get_print_file_path()
+                pdf_content = PrintFileCache.read(file_path) if file_path is not None else None
+                if pdf_content is None:
+                    pdf_content = self.generate_print_content()
+                    if file_path is not None:
+                        PrintFileCache.write(file_path, pdf_content)
+                self.print_file = [(pdf_name, BytesIO(pdf_content))]
         else:
             self.print_file = None
             self.item = None
@@ -588,7 +995,7 @@ class EmailSent(LucteriosModel):
         else:
             return self.message.attach_files
 
-    def replace_tag(self, text):
+    def get_tag_values(self, with_footer=True):
         if not hasattr(self, 'item'):
             self._extract_obj()
         contact = None
@@ -607,53 +1014,79 @@ class EmailSent(LucteriosModel):
             first_doc_name = self.get_attach_files()[0][0]
         if contact is None:
             contact = self.contact
-        text = text.replace('#name', contact.get_final_child().get_presentation() if contact is not None else '???')
-        text = text.replace('#doc', first_doc_name)
-        text = text.replace('#reference', doc_reference)
-        if "#footer" in text:
-            footer_contain = ""
-            if hasattr(self.item, 'get_email_footer'):
-                footer_contain = self.item.get_email_footer()
-            text = text.replace('#footer', footer_contain)
-        return text
-
-    def send_email(self, http_root_address):
-        getLogger('lucterios.mailing').debug('EmailSent.send_email(http_root_address=%s)', http_root_address)
-        try:
-            if http_root_address != '':
-                self.message.http_root_address = http_root_address
-                img_html = "<img src='%s/lucterios.mailing/emailSentAddForStatistic?emailsent=%d' alt=''/>" % (http_root_address, self.id)
-            else:
-                img_html = ""
-            body = self.replace_tag(self.message.email_content)
+        footer_contain = ""
+        if with_footer and hasattr(self.item, 'get_email_footer'):
+            footer_contain = self.item.get_email_footer()
+        return {'#name': contact.get_final_child().get_presentation() if contact is not None else '???',
+                '#doc': first_doc_name,
+                '#reference': doc_reference,
+                '#footer': footer_contain}
+
+    def get_send_files(self):
+        if not hasattr(self, 'print_file'):
+            self._extract_obj()
+        if self.print_file is not None:
+            return self.print_file
+        else:
+            return self.message.encoded_attach_files
+
+    def replace_tag(self, text):
+        template = CompiledTemplate(text, self.TAG_LIST)
+        return template.render(self.get_tag_values('#footer' in template))
+
+    def prepare_email(self, http_root_address):
+        if http_root_address != '':
+            self.message.http_root_address = http_root_address
+            img_html = "<img src='%s/lucterios.mailing/emailSentAddForStatistic?emailsent=%d' alt=''/>" % (http_root_address, self.id)
+        else:
+            img_html = ""
+        subject_template, body_template, text_template = self.message.get_email_template()
+        tag_values = self.get_tag_values(('#footer' in subject_template) or ('#footer' in body_template))
+        body = body_template.render(tag_values)
+        if text_template is not None:
+            body_txt = text_template.render(tag_values)
+        else:
             h2txt = HTML2Text()
             h2txt.ignore_links = False
             body_txt = h2txt.handle(body)
-            if img_html != "":
-                body = body.replace('</body>', img_html + '</body>')
-            email, ccemail = self.get_emails()
-            getLogger('lucterios.mailing').debug('send email %s : %s' % (self.message.subject, email))
-            no_send_list = send_email(split_doubled_email(email), self.replace_tag(self.message.subject), body, files=self.get_attach_files(), cclist=split_doubled_email(ccemail), withcopy=self.item is not None, body_txt=body_txt)
-            self.success = True
-            if len(no_send_list) > 0:
-                email_list = email
-                if ccemail is not None:
-                    email_list.extend(ccemail)
-                for email_item in split_doubled_email(email_list):
-                    if email_item not in no_send_list:
-                        no_send_list[email_item] = 'OK'
-                self.error = str(no_send_list)
-        except Exception as error:
-            if getLogger('lucterios.mailing').isEnabledFor(DEBUG):
-                getLogger('lucterios.mailing').exception('send_email')
-            self.success = False
-            self.error = str(error)
+        if img_html != "":
+            body = body.replace('</body>', img_html + '</body>')
+        self._emails = self.get_emails()
+        email, ccemail = self._emails
+        getLogger('lucterios.mailing').debug('send email %s : %s' % (self.message.subject, email))
+        return prepare_email(split_doubled_email(email), subject_template.render(tag_values), body, files=self.get_send_files(), cclist=split_doubled_email(ccemail), withcopy=self.item is not None, body_txt=body_txt)
+
+    def set_email_result(self, no_send_list):
+        self.success = True
+        if len(no_send_list) > 0:
+            email_list, ccemail = self._emails
+            if ccemail is not None:
+                email_list.extend(ccemail)
+            for email_item in split_doubled_email(email_list):
+                if email_item not in no_send_list:
+                    no_send_list[email_item] = 'OK'
+            self.error = str(no_send_list)
+        self.save()
+
+    def set_email_error(self, error):
+        if getLogger('lucterios.mailing').isEnabledFor(DEBUG):
+            getLogger('lucterios.mailing').exception('send_email')
+        self.success = False
+        self.error = str(error)
         self.save()
 
+    def send_email(self, http_root_address, session=None):
+        getLogger('lucterios.mailing').debug('EmailSent.send_email(http_root_address=%s)', http_root_address)
+        try:
+            self.set_email_result(submit_email(session, *self.prepare_email(http_root_address)))
+        except Exception as error:
+            self.set_email_error(error)
+
     def send_sms(self, provider):
         getLogger('lucterios.mailing').debug('EmailSent.send_sms()')
         try:
-            body = self.replace_tag(self.message.email_content)
+            _subject_template, body_template, _text_template = self.message.get_email_template()
+            body = body_template.render(self.get_tag_values('#footer' in body_template))
             getLogger('lucterios.mailing').debug('send sms %s : %s' % (self.message.subject, self.email))
             provider.send_sms(self.email, body)
             self.success = True
@@ -708,6 +1141,10 @@ def mailing_checkparam():
                                value=_('''Connection confirmation to your application:{[br/]} - Login:%(login)s{[br/]} - Password:%(password)s{[br/]}'''))
     Parameter.check_and_create(name='mailing-delay-batch', typeparam=2, title=_("mailing-delay-batch"), args="{'Min': 0.1, 'Max': 120, 'Prec': 1}", value='15')
     Parameter.check_and_create(name='mailing-nb-by-batch', typeparam=1, title=_("mailing-nb-by-batch"), args="{'Min': 1, 'Max': 100}", value='10')
+    Parameter.check_and_create(name='mailing-smtp-engine', typeparam=4, title=_("mailing-smtp-engine"), args="{'Enum':2}", value='0',
+                               param_titles=(_("mailing-smtp-engine.0"), _("mailing-smtp-engine.1")))
+    Parameter.check_and_create(name='mailing-nb-connection', typeparam=1, title=_("mailing-nb-connection"), args="{'Min': 1, 'Max': 20}", value='1')
+    Parameter.check_and_create(name='mailing-nb-render-process', typeparam=1, title=_("mailing-nb-render-process"), args="{'Min': 1, 'Max': 16}", value='1')
 
     Parameter.check_and_create(name='mailing-dkim-private-path', typeparam=0, title=_("mailing-dkim-private-path"), args="{'Multi': False}", value='')
     Parameter.check_and_create(name='mailing-dkim-selector', typeparam=0, title=_("mailing-dkim-selector"), args="{'Multi': False}", value='default')
@@ -723,4 +1160,5 @@ def mailing_checkparam():
 
 @Signal.decorate('auditlog_register')
 def mailing_auditlog_register():
-    auditlog.register(Message, include_fields=['status', 'date', 'subject', 'body', 'recipients', 'attachments'])
+    auditlog.register(Message, include_fields=['status', 'date', 'subject', 'body', 'phone_field_names', 'attachments'])
+    auditlog.register(MessageRecipient, include_fields=['modelname', 'criteria'])
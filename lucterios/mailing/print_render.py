@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.mailing package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from os import environ
+
+# Functions run in spawned render processes: this module must stay importable before django.setup().
+
+
+def init_render_process(settings_module, database_names):
+    environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    import django
+    django.setup()
+    from django.db import connections
+    for alias, database_name in database_names.items():
+        connections[alias].settings_dict['NAME'] = database_name
+
+
+def render_print_file(email, file_path):
+    from lucterios.mailing.models import EmailSent, PrintFileCache
+    email_sent = EmailSent(email=email)
+    email_sent.load_print_item()
+    PrintFileCache.write(file_path, email_sent.generate_print_content())
+    return file_path
@@ -44,7 +44,7 @@ def decode_b64(data):
     return decoded.decode('utf-8')
 
 
-def configSMTP(server, port, security=0, user='', passwd='', batchtime=0.1, batchsize=20, dkim_private_file=''):
+def configSMTP(server, port, security=0, user='', passwd='', batchtime=0.1, batchsize=20, dkim_private_file='', nb_connection=1, nb_render_process=1, smtp_engine=0):
     Params.setvalue(name='mailing-smtpserver', value=server)
     Params.setvalue(name='mailing-smtpport', value=port)
     Params.setvalue(name='mailing-smtpsecurity', value=security)
@@ -53,6 +53,9 @@ def configSMTP(server, port, security=0, user='', passwd='', batchtime=0.1, batc
     Params.setvalue(name='mailing-dkim-private-path', value=dkim_private_file)
     Params.setvalue(name='mailing-delay-batch', value="%.1f" % batchtime)
     Params.setvalue(name='mailing-nb-by-batch', value="%.d" % batchsize)
+    Params.setvalue(name='mailing-smtp-engine', value="%d" % smtp_engine)
+    Params.setvalue(name='mailing-nb-connection', value="%.d" % nb_connection)
+    Params.setvalue(name='mailing-nb-render-process', value="%.d" % nb_render_process)
 
 
 def configSMS(file_name='/tmp/sms.txt', max_sms=3):
@@ -92,7 +95,7 @@ class TestSMTPChannel(smtpd.SMTPChannel):
             raise ExitNow()
 
     def smtp_EHLO(self, arg):
-        if self.smtp_server.with_authentificate:
+        if self.smtp_server.with_authentificate or self.smtp_server.with_pipelining:
             if not arg:
                 self.push('501 Syntax: EHLO hostname')
                 return
@@ -102,11 +105,21 @@ class TestSMTPChannel(smtpd.SMTPChannel):
                 self.seen_greeting = arg
                 self.extended_smtp = True
                 self.push('250-%s Hello %s' % (self.fqdn, arg))
-                self.push('250-AUTH LOGIN PLAIN')
+                if self.smtp_server.with_authentificate:
+                    self.push('250-AUTH LOGIN PLAIN')
+                if self.smtp_server.with_pipelining:
+                    self.push('250-PIPELINING')
                 self.push('250 EHLO')
         else:
             smtpd.SMTPChannel.smtp_EHLO(self, arg)
 
+    def smtp_MAIL(self, arg):
+        if self.smtp_server.drop_connection:
+            self.smtp_server.drop_connection = False
+            self.close()
+            return
+        smtpd.SMTPChannel.smtp_MAIL(self, arg)
+
     def smtp_RCPT(self, arg):
         if self.smtp_server.wrong_email is not None:
             import re
@@ -124,8 +137,10 @@ class TestSMTPServer(smtpd.SMTPServer):
     channel_class = TestSMTPChannel
     emails = []
     with_authentificate = False
+    with_pipelining = False
     auth_params = None
     wrong_email = None
+    drop_connection = False
 
     def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
         self.emails.append((peer, mailfrom, rcpttos, data))
@@ -141,8 +156,10 @@ class TestReceiver(TestCase):
         self.smtp = TestSMTPServer(('0.0.0.0', port), None)
         self.smtp.emails = []
         self.smtp.with_authentificate = False
+        self.smtp.with_pipelining = False
         self.smtp.auth_params = None
         self.smtp.wrong_email = None
+        self.smtp.drop_connection = False
         self.thread = Thread(target=asyncore.loop, kwargs={'timeout': 1})
         self.thread.start()
 
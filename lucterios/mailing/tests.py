@@ -44,8 +44,10 @@ from lucterios.contacts.test_tools import change_ourdetail, create_jack
 from lucterios.contacts.views import CreateAccount
 from lucterios.contacts.models import Individual, LegalEntity
 
-from lucterios.mailing.views import Configuration, SendEmailTry, SendSmsTry
-from lucterios.mailing.email_functions import will_mail_send, send_email, EmailException
+from lucterios.mailing.views import Configuration, SendEmailTry, SendSmsTry, paramchange_mailing
+from lucterios.mailing.email_functions import will_mail_send, send_email, EmailException, SMTPSession, prepare_email,\
+    CompiledTemplate, encode_attachment, DKIMSigner, SMTPDataWriter
+from lucterios.mailing.email_async import AsyncSMTPPool, send_email as async_send_email
 from lucterios.mailing.test_tools import configSMTP, decode_b64, TestReceiver,\
     configSMS, clean_sms_testfile, read_sms
 
@@ -72,7 +74,7 @@ class ConfigurationTest(LucteriosTest):
         self.calljson('/lucterios.mailing/configuration', {}, False)
         self.assert_observer('core.custom', 'lucterios.mailing', 'configuration')
         self.assertEqual(len(self.json_context), 0)
-        self.assert_count_equal('', 3 + 11 + 3 + 3)  # Nb tab + params email + message + params sms
+        self.assert_count_equal('', 3 + 14 + 3 + 3)  # Nb tab + params email + message + params sms
         self.assert_json_equal('LABELFORM', "mailing-smtpserver", '')
         self.assert_json_equal('LABELFORM', "mailing-smtpport", '25')
         self.assert_json_equal('LABELFORM', "mailing-smtpsecurity", 'Aucune')
@@ -84,6 +86,9 @@ class ConfigurationTest(LucteriosTest):
                                '{[p]}Bienvenue{[br/]}{[br/]}Confirmation de connexion à votre application :{[br/]} - Identifiant : %(login)s{[br/]} - Mot de passe : %(password)s{[br/]}{[br/]}Salutations{[br/]}{[/p]}')
         self.assert_json_equal('LABELFORM', "mailing-delay-batch", '15.0')
         self.assert_json_equal('LABELFORM', "mailing-nb-by-batch", '10')
+        self.assert_json_equal('LABELFORM', "mailing-smtp-engine", 'Standard')
+        self.assert_json_equal('LABELFORM', "mailing-nb-connection", '1')
+        self.assert_json_equal('LABELFORM', "mailing-nb-render-process", '1')
         self.assert_json_equal('LABELFORM', 'mailing-sms-provider', None)
 
     def test_tryemail_noconfig(self):
@@ -107,6 +112,20 @@ class ConfigurationTest(LucteriosTest):
             dkim_private_file = ""
         return dkim_private_file
 
+    def test_dkim_signer_cache(self):
+        dkim_private_file = self.create_dkim_file()
+        if dkim_private_file != "":
+            self.assertEqual(None, DKIMSigner.get_signer('', 'default'))
+            signer = DKIMSigner.get_signer(dkim_private_file, 'default')
+            self.assertIs(signer, DKIMSigner.get_signer(dkim_private_file, 'default'))
+            msg_content = signer.sign("From: a@worldcompany.com\nTo: b@worldcompany.com\nSubject: test\n\nbody\n", 'worldcompany.com')
+            self.assertEqual('DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/simple; d=worldcompany.com;', msg_content[:72])
+            self.assertTrue(msg_content.endswith("\nFrom: a@worldcompany.com\nTo: b@worldcompany.com\nSubject: test\n\nbody\n"))
+            paramchange_mailing(['mailing-dkim-selector'])
+            self.assertIsNot(signer, DKIMSigner.get_signer(dkim_private_file, 'default'))
+        else:
+            print("-- NO DKIM --")
+
     def test_tryemail_success(self):
         dkim_private_file = self.create_dkim_file()
         configSMTP('localhost', 1025, dkim_private_file=dkim_private_file)
@@ -155,7 +174,7 @@ class ConfigurationTest(LucteriosTest):
         self.factory.xfer = Configuration()
         self.calljson('/lucterios.mailing/configuration', {}, False)
         self.assert_observer('core.custom', 'lucterios.mailing', 'configuration')
-        self.assert_count_equal('', 3 + 11 + 3 + 3)  # Nb tab + params email + message + params sms
+        self.assert_count_equal('', 3 + 14 + 3 + 3)  # Nb tab + params email + message + params sms
         self.assert_json_equal('LABELFORM', 'mailing-sms-provider', None)
 
         self.factory.xfer = ParamEdit()
@@ -170,7 +189,7 @@ class ConfigurationTest(LucteriosTest):
         self.factory.xfer = Configuration()
         self.calljson('/lucterios.mailing/configuration', {}, False)
         self.assert_observer('core.custom', 'lucterios.mailing', 'configuration')
-        self.assert_count_equal('', 3 + 11 + 3 + 8)  # Nb tab + params email + message + params sms
+        self.assert_count_equal('', 3 + 14 + 3 + 8)  # Nb tab + params email + message + params sms
         self.assert_json_equal('LABELFORM', 'mailing-sms-provider', 'Test provider')
         self.assert_json_equal('LABELFORM', 'mailing-sms-phone-parse', '^0([67][0-9]{8})$|+33{0}')
         self.assert_json_equal('LABELFORM', 'mailing-sms-option', 'file name = /tmp/sms.txt{[br/]}max = 10')
@@ -181,7 +200,7 @@ class ConfigurationTest(LucteriosTest):
         self.factory.xfer = Configuration()
         self.calljson('/lucterios.mailing/configuration', {}, False)
         self.assert_observer('core.custom', 'lucterios.mailing', 'configuration')
-        self.assert_count_equal('', 3 + 11 + 3 + 8)  # Nb tab + params email + message + params sms
+        self.assert_count_equal('', 3 + 14 + 3 + 8)  # Nb tab + params email + message + params sms
         self.assert_json_equal('BUTTON', 'trysms', '')
 
     def test_trysms(self):
@@ -268,6 +287,72 @@ class ConfigurationTest(LucteriosTest):
         self.assertEqual('Yessss!!!', decode_b64(msg.get_payload()))
         self.assertEqual(None, self.server.smtp.auth_params)
 
+    def test_send_session(self):
+        configSMTP('localhost', 1025)
+        handshake_count = SMTPSession.handshake_count
+        with SMTPSession.from_params(max_messages=2) as session:
+            for idx in range(3):
+                self.assertEqual({}, send_email('toto@machin.com', 'send by session %d' % idx, 'Yessss!!!', session=session))
+            self.assertEqual(1, session.nb_sent)
+        self.assertEqual(None, session.server)
+        self.assertEqual(3, self.server.count())
+        self.assertEqual(handshake_count + 2, SMTPSession.handshake_count)
+
+    def test_send_session_reconnect(self):
+        configSMTP('localhost', 1025)
+        handshake_count = SMTPSession.handshake_count
+        with SMTPSession.from_params() as session:
+            self.assertEqual({}, send_email('toto@machin.com', 'send before break', 'Yessss!!!', session=session))
+            old_server = session.server
+            self.assertEqual(handshake_count + 1, SMTPSession.handshake_count)
+            self.server.smtp.drop_connection = True
+            self.assertEqual({}, send_email('toto@machin.com', 'send after break', 'Yessss!!!', session=session))
+            self.assertEqual(None, old_server.sock)
+            self.assertNotEqual(old_server, session.server)
+            self.assertEqual(1, session.nb_sent)
+        self.assertEqual(handshake_count + 2, SMTPSession.handshake_count)
+        self.assertEqual(2, self.server.count())
+        self.assertEqual(['toto@machin.com'], self.server.get(1)[2])
+
+    def test_send_async(self):
+        configSMTP('localhost', 1025)
+        self.server.smtp.wrong_email = 'titi@machin.com'
+        ret = async_send_email(['toto@machin.com', 'titi@machin.com'], 'send async', 'Yessss!!!')
+        self.assertEqual(['titi@machin.com'], list(ret.keys()))
+        self.assertEqual(1, self.server.count())
+        self.assertEqual(['toto@machin.com'], self.server.get(0)[2])
+        msg, = self.server.check_first_message('send async', 1, {'To': 'toto@machin.com, titi@machin.com', 'Cc': ''})
+        self.assertEqual('Yessss!!!', decode_b64(msg.get_payload()))
+        try:
+            async_send_email('titi@machin.com', 'send async refused', 'Nooo!!!')
+            self.assertTrue(False)
+        except EmailException as error:
+            self.assertTrue('titi@machin.com' in str(error), str(error))
+        self.assertEqual(1, self.server.count())
+
+    def test_send_async_pool(self):
+        self.server.smtp.with_authentificate = True
+        self.server.smtp.with_pipelining = True
+        configSMTP('localhost', 1025, 0, 'toto', 'abc123')
+        handshake_count = SMTPSession.handshake_count
+        with AsyncSMTPPool(2, max_messages=2) as pool:
+            sendings = [pool.submit(*prepare_email('toto%d@machin.com' % idx, 'send async %d' % idx, '.start with a dot')) for idx in range(5)]
+            self.assertEqual([{}, {}, {}, {}, {}], [sending.result() for sending in sendings])
+        self.assertEqual(5, self.server.count())
+        self.assertEqual(['toto0@machin.com', 'toto1@machin.com', 'toto2@machin.com', 'toto3@machin.com', 'toto4@machin.com'],
+                         sorted([rcpttos[0] for rcpttos in self.server.email_list()]))
+        self.assertEqual(handshake_count + 3, SMTPSession.handshake_count)
+        self.assertEqual(['', 'toto', 'abc123'], self.server.smtp.auth_params)
+        msg, = self.server.check_first_message(None, 1)
+        self.assertEqual('.start with a dot', decode_b64(msg.get_payload()))
+
+    def test_compiled_template(self):
+        template = CompiledTemplate("<b>#name</b> - #doc#doc ##reference", ('#name', '#doc', '#reference', '#footer'))
+        self.assertTrue('#name' in template)
+        self.assertFalse('#footer' in template)
+        self.assertEqual("<b>jack</b> - file.pdffile.pdf #ref-12", template.render({'#name': 'jack', '#doc': 'file.pdf', '#reference': 'ref-12'}))
+        self.assertEqual("<b>#doc</b> -  #", template.render({'#name': '#doc', '#doc': '', '#reference': ''}))
+
     def test_send_copyhimself(self):
         configSMTP('localhost', 1025)
         self.assertEqual(0, self.server.count())
@@ -463,6 +548,32 @@ En here, there are a nice [link](https://truc-muche-machin.zb/aaaa_aaa/bbbb-bbbb
             file1.close()
             file2.close()
 
+    def test_send_with_encoded_files(self):
+        configSMTP('localhost', 1025)
+        encoded_file = encode_attachment('filename1.txt', BytesIO(get_binay('blablabla\blabla.')))
+        for idx in range(2):
+            send_email('toto%d@machin.com' % idx, 'send with encoded file', 'file sent!', [encoded_file])
+        self.assertEqual(2, self.server.count())
+        for idx in range(2):
+            _msg, msg_f1 = self.server.get_msg_index(idx, 'send with encoded file')
+            self.assertTrue('filename1.txt' in msg_f1.get('Content-Type', ''), msg_f1.get('Content-Type', ''))
+            self.assertEqual('blablabla\blabla.', decode_b64(msg_f1.get_payload()))
+
+    def test_send_stream(self):
+        chunks = []
+        data_writer = SMTPDataWriter(chunks.append, 4)
+        for text in ['.a', 'b\r\n', '.c\r\n.d']:
+            data_writer.write(text)
+        data_writer.close()
+        self.assertEqual([b'..ab', b'\r\n..', b'c\r\n.', b'.d\r\n', b'.\r\n'], chunks)
+        configSMTP('localhost', 1025)
+        big_file = encode_attachment('big.bin', BytesIO(b'0123456789' * 50000))
+        self.assertEqual({}, send_email('toto@machin.com', 'send stream', '.start with a dot\n.and other line', [big_file]))
+        self.assertEqual(1, self.server.count())
+        msg, msg_f1 = self.server.check_first_message('send stream', 2)
+        self.assertEqual('.start with a dot\n.and other line', decode_b64(msg.get_payload()))
+        self.assertEqual(b'0123456789' * 50000, b64decode(msg_f1.get_payload()))
+
     def test_user_withoutconfig(self):
         configSMTP('', 25)
         self.factory.xfer = UsersEdit()
@@ -25,6 +25,16 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 from base64 import b64decode
 from time import sleep
+from os import unlink, close
+from os.path import isfile
+from datetime import timedelta
+from tempfile import mkstemp
+from contextlib import closing
+import sqlite3
+
+from django.db import connection
+
+from django.utils import timezone
 
 
 from lucterios.framework.test import LucteriosTest, AsychronousLucteriosTest
@@ -36,15 +46,15 @@ from lucterios.contacts.test_tools import change_ourdetail, create_jack
 from lucterios.documents.tests import create_doc
 from lucterios.documents.models import DocumentContainer
 
-from lucterios.mailing.models import Message
-from lucterios.mailing.email_functions import will_mail_send
+from lucterios.mailing.models import Message, MessageOutbox, PrintFileCache, EmailSent
+from lucterios.mailing.email_functions import will_mail_send, SMTPSession
 from lucterios.mailing.views_message import MessageAddModify, MessageDel, MessageShow, MessageValidRecipient, MessageDelRecipient, MessageLetter, MessageTransition, MessageInsertDoc,\
     MessageValidInsertDoc, MessageRemoveDoc, MessageSendEmailTry, MessageEmailList, MessageSMSList,\
     MessageSendSMSTry, MessageShowDoc
 from lucterios.mailing.test_tools import configSMTP, decode_b64, TestReceiver,\
     configSMS, clean_sms_testfile, read_sms
 from lucterios.mailing.sms_functions import AbstractProvider
-from lucterios.contacts.models import CustomField
+from lucterios.contacts.models import CustomField, LegalEntity, Individual
 
 
 class MailingTest(LucteriosTest):
@@ -55,6 +65,76 @@ class MailingTest(LucteriosTest):
         self.jack = create_jack(firstname="jack", lastname="MISTER", with_email=True)
         self.jean = create_jack(firstname="jean", lastname="Valjean", with_email=False)
 
+    def test_recipients_cache(self):
+        email_msg = Message.objects.create(subject="cache", body="body", message_type=0)
+        email_msg.add_recipient('contacts.Individual', '')
+        email_msg.add_recipient('contacts.LegalEntity', '')
+        self.assertEqual(3, email_msg.contact_nb)
+        self.assertEqual(['Valjean jean'], email_msg.contact_noemail)
+        self.assertEqual(3, len(list(email_msg.get_email_contacts())))
+        self.assertEqual(1, email_msg.get_contact_noemail_nb())
+        self.assertEqual(0, email_msg.get_contact_nosms_nb())
+
+        create_jack(firstname="paul", lastname="DURAND", with_email=False)
+        self.assertEqual(4, email_msg.contact_nb)
+        self.assertEqual(['DURAND paul', 'Valjean jean'], sorted(email_msg.contact_noemail))
+
+        email_msg.del_recipient(0)
+        self.assertEqual(1, email_msg.contact_nb)
+        self.assertEqual([], email_msg.contact_noemail)
+
+    def test_recipient_rows(self):
+        sms_msg = Message.objects.create(subject="rows", body="body", message_type=1)
+        sms_msg.add_recipient('contacts.Individual', 'lastname||5||MISTER')
+        sms_msg.add_recipient('contacts.LegalEntity', '')
+        sms_msg.set_sms_field_names('tel1;tel2')
+        self.assertEqual(['contacts.Individual', 'contacts.LegalEntity'], list(sms_msg.messagerecipient_set.values_list('modelname', flat=True)))
+        self.assertEqual(['tel1', 'tel2'], list(sms_msg.get_sms_field_names(translate=False)))
+        self.assertEqual(2, sms_msg.recipients_count)
+        self.assertEqual("# fieldnames: tel1;tel2\ncontacts.Individual lastname||5||MISTER\ncontacts.LegalEntity \n", sms_msg.recipients)
+
+        sms_msg = Message.objects.get(id=sms_msg.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(['contacts.Individual', 'contacts.LegalEntity'], [recipient.modelname for recipient in sms_msg.get_recipient_list()])
+            self.assertEqual(['contacts.Individual', 'contacts.LegalEntity'], [recipient.modelname for recipient in sms_msg.get_recipient_list()])
+        self.assertEqual(['contacts.Individual', 'contacts.LegalEntity'], [modelname for modelname, _item in sms_msg.get_recipients()])
+
+        sms_msg.del_recipient(5)
+        self.assertEqual(2, sms_msg.messagerecipient_set.count())
+        sms_msg.del_recipient(0)
+        self.assertEqual(['contacts.LegalEntity'], [modelname for modelname, _item in sms_msg.get_recipients()])
+        self.assertEqual(['tel1', 'tel2'], list(sms_msg.get_sms_field_names(translate=False)))
+
+        sms_msg.recipients = "# fieldnames: tel2\ncontacts.Individual lastname||5||MISTER\n"
+        sms_msg.save()
+        sms_msg = Message.objects.get(id=sms_msg.id)
+        self.assertEqual(['contacts.Individual'], list(sms_msg.messagerecipient_set.values_list('modelname', flat=True)))
+        self.assertEqual(['tel2'], list(sms_msg.get_sms_field_names(translate=False)))
+
+    def test_outbox_claim(self):
+        email_msg = Message.objects.create(subject="outbox", body="body", message_type=0)
+        email_msg.add_recipient('contacts.Individual', '')
+        email_msg.add_recipient('contacts.LegalEntity', '')
+        self.assertEqual(2, email_msg.prep_sending())
+        self.assertEqual('', email_msg.email_to_send)
+        self.assertEqual(2, email_msg.messageoutbox_set.count())
+
+        first_claim = MessageOutbox.claim(email_msg, 1)
+        self.assertEqual(1, len(first_claim))
+        self.assertEqual(MessageOutbox.STATUS_CLAIMED, first_claim[0].status)
+        self.assertEqual(1, first_claim[0].attempts)
+        second_claim = MessageOutbox.claim(email_msg)
+        self.assertEqual(1, len(second_claim))
+        self.assertNotEqual(first_claim[0].id, second_claim[0].id)
+        self.assertEqual([], MessageOutbox.claim(email_msg))
+        self.assertFalse(MessageOutbox.is_finished(email_msg))
+
+        email_msg.messageoutbox_set.update(next_attempt=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(2, len(MessageOutbox.claim(email_msg)))
+        email_msg.messageoutbox_set.update(attempts=MessageOutbox.MAX_ATTEMPTS, next_attempt=timezone.now() - timedelta(minutes=1))
+        self.assertEqual([], MessageOutbox.claim(email_msg))
+        self.assertTrue(MessageOutbox.is_finished(email_msg))
+
     def test_messages(self):
         self.factory.xfer = MessageEmailList()
         self.calljson('/lucterios.mailing/messageEmailList', {}, False)
@@ -152,7 +232,7 @@ class MailingTest(LucteriosTest):
         self.assert_json_equal('', "recipient_list/@0/filter", '{[b]}genre{[/b]} égal {[i]}"Homme"{[/i]}')
         self.assert_json_equal('', "recipient_list/@1/model", "Contact Générique")
         self.assert_json_equal('', "recipient_list/@2/model", "Personne Morale")
-        self.assert_json_equal('LABELFORM', "contact_nb", 5)
+        self.assert_json_equal('LABELFORM', "contact_nb", 3)
 
         self.factory.xfer = MessageDelRecipient()
         self.calljson('/lucterios.mailing/messageDelRecipient',
@@ -435,6 +515,8 @@ Deque his rebus satis multa in nostris de re publica libris sunt dicta a Laelio.
             email_msg.valid()
             self.assertEqual(3, email_msg.contact_nb)
             self.assertEqual(['Valjean jean'], email_msg.contact_noemail)
+            contacts = list(email_msg.get_email_contacts())
+            self.assertEqual([Individual, Individual, LegalEntity], [contact.__class__ for contact in contacts])
             email_msg.prep_sending()
             email_msg.status = 2
             email_msg.save()
@@ -462,6 +544,61 @@ Deque his rebus satis multa in nostris de re publica libris sunt dicta a Laelio.
         finally:
             server.stop()
 
+    def test_send_parallel(self):
+        create_jack(firstname="joe", lastname='Dalton')
+        create_jack(firstname="wiliam", lastname='Dalton')
+
+        configSMTP('localhost', 1025, nb_connection=2)
+        server = TestReceiver()
+        server.start(1025)
+        try:
+            email_msg = Message.objects.create(subject="Sending parallel", body="{[b]}#name{[/b]}{[br/]}Bye", message_type=0)
+            email_msg.add_recipient('contacts.Individual', '')
+            email_msg.add_recipient('contacts.LegalEntity', '')
+            email_msg.valid()
+            self.assertEqual(4, email_msg.prep_sending())
+            email_msg.status = 2
+            email_msg.save()
+            self.assertEqual(0, server.count())
+
+            handshake_count = SMTPSession.handshake_count
+            email_msg.sendemail(10, "http://testserver")
+            self.assertEqual(4, server.count())
+            self.assertEqual(handshake_count + 2, SMTPSession.handshake_count)
+            self.assertEqual(['jack@worldcompany.com', 'joe@worldcompany.com', 'mr-sylvestre@worldcompany.com', 'wiliam@worldcompany.com'],
+                             sorted([rcpttos[0] for rcpttos in server.email_list()]))
+            self.assertEqual(4, email_msg.emailsent_set.filter(success=True).count())
+            self.assertEqual(0, email_msg.messageoutbox_set.count())
+            self.assertEqual(Message.STATUS_VALIDATED, Message.objects.get(id=email_msg.id).status)
+        finally:
+            server.stop()
+
+    def test_send_async_engine(self):
+        create_jack(firstname="joe", lastname='Dalton')
+
+        configSMTP('localhost', 1025, nb_connection=2, smtp_engine=1)
+        server = TestReceiver()
+        server.start(1025)
+        try:
+            email_msg = Message.objects.create(subject="Sending async", body="{[b]}#name{[/b]}{[br/]}Bye", message_type=0)
+            email_msg.add_recipient('contacts.Individual', '')
+            email_msg.add_recipient('contacts.LegalEntity', '')
+            email_msg.valid()
+            self.assertEqual(3, email_msg.prep_sending())
+            email_msg.status = 2
+            email_msg.save()
+
+            handshake_count = SMTPSession.handshake_count
+            email_msg.sendemail(10, "http://testserver")
+            self.assertEqual(3, server.count())
+            self.assertEqual(handshake_count + 2, SMTPSession.handshake_count)
+            self.assertEqual(['jack@worldcompany.com', 'joe@worldcompany.com', 'mr-sylvestre@worldcompany.com'],
+                             sorted([rcpttos[0] for rcpttos in server.email_list()]))
+            self.assertEqual(3, email_msg.emailsent_set.filter(success=True).count())
+            self.assertEqual(Message.STATUS_VALIDATED, Message.objects.get(id=email_msg.id).status)
+        finally:
+            server.stop()
+
     def test_send_classic_with_bad_email(self):
         self.factory.user = LucteriosUser.objects.create(username='empty')
         self.factory.user.is_superuser = True
@@ -544,8 +681,14 @@ Deque his rebus satis multa in nostris de re publica libris sunt dicta a Laelio.
             email_msg.save()
             self.assertEqual(0, server.count())
 
+            self.assertEqual("contacts.Individual:0:%d" % print_model.id, email_msg.email_to_send)
+
+            handshake_count = SMTPSession.handshake_count
             email_msg.sendemail(10, "http://testserver")
             self.assertEqual(4, server.count())
+            self.assertEqual(handshake_count + 1, SMTPSession.handshake_count)
+            self.assertEqual(0, email_msg.messageoutbox_set.count())
+            self.assertEqual("contacts.Individual:0:%d" % print_model.id, Message.objects.get(id=email_msg.id).email_to_send)
             self.assertEqual('mr-sylvestre@worldcompany.com', server.get(0)[1])
             self.assertEqual(['jack@worldcompany.com', 'mr-sylvestre@worldcompany.com'], server.get(0)[2])
             self.assertEqual('mr-sylvestre@worldcompany.com', server.get(1)[1])
@@ -573,6 +716,47 @@ Deque his rebus satis multa in nostris de re publica libris sunt dicta a Laelio.
         finally:
             server.stop()
 
+    def test_send_dynamic_print_cache(self):
+        print_model = self.get_print_model()
+
+        joe = create_jack(firstname="joe", lastname='Dalton')
+        create_jack(firstname="avrel", lastname='Dalton')
+
+        configSMTP('localhost', 1025, nb_render_process=2)
+        server = TestReceiver()
+        server.start(1025)
+        try:
+            email_msg = Message.objects.create(subject="Sending '#reference'", body="{[b]}#name{[/b]}{[br/]}Bye",
+                                               email_to_send="contacts.Individual:0:%d" % print_model.id, message_type=0)
+            email_msg.add_recipient('contacts.Individual', 'id||8||4;5')
+            email_msg.save()
+            email_msg.valid()
+            email_msg.prep_sending()
+            email_msg.status = 2
+            email_msg.save()
+            cache_path = PrintFileCache.get_path('contacts.Individual', joe, print_model)
+            if isfile(cache_path):
+                unlink(cache_path)
+            self.assertEqual(None, PrintFileCache.read(cache_path))
+
+            email_msg.sendemail(10, "http://testserver")
+            self.assertEqual(2, server.count())
+            pdf_content = PrintFileCache.read(cache_path)
+            self.assertNotEqual(None, pdf_content)
+            _msg_txt, _msg, msg_file = server.get_msg_index(0, "Sending '4'")
+            self.assertEqual(pdf_content, b64decode(msg_file.get_payload()))
+
+            joe.firstname = 'joseph'
+            joe.save()
+            new_cache_path = PrintFileCache.get_path('contacts.Individual', joe, print_model)
+            self.assertNotEqual(cache_path, new_cache_path)
+            print_model.value = print_model.value.replace('font_size="15"', 'font_size="12"')
+            print_model.save()
+            self.assertNotEqual(new_cache_path, PrintFileCache.get_path('contacts.Individual', joe, print_model))
+            self.assertEqual(None, PrintFileCache.get_path('CORE.LucteriosUser', LucteriosUser.objects.get(username='admin'), print_model))
+        finally:
+            server.stop()
+
     def test_send_dynamic_with_bad_email(self):
         print_model = self.get_print_model()
 
@@ -741,7 +925,7 @@ class SMSTest(LucteriosTest):
         self.assert_json_equal('', "recipient_list/@0/filter", '{[b]}genre{[/b]} égal {[i]}"Homme"{[/i]}')
         self.assert_json_equal('', "recipient_list/@1/model", "Contact Générique")
         self.assert_json_equal('', "recipient_list/@2/model", "Personne Morale")
-        self.assert_json_equal('LABELFORM', "contact_nb", 5)
+        self.assert_json_equal('LABELFORM', "contact_nb", 3)
 
     def test_validate_message(self):
         self.jean.tel1 = ''
@@ -834,6 +1018,13 @@ class SMSTest(LucteriosTest):
         self.assertEqual(['tel1', 'tel2', 'custom_3'], list(sms_msg.get_sms_field_names(translate=False)))
         self.assertEqual(3, sms_msg.contact_nb)
         self.assertEqual(['Valjean jean : 02-78-45-12-95'], sms_msg.contact_nosms)
+        self.assertEqual(1, sms_msg.get_contact_nosms_nb())
+        other_msg = Message.objects.create(subject="other message", body="Small message", message_type=1)
+        other_msg.set_sms_field_names('tel1;tel2')
+        other_msg.add_recipient('contacts.Individual', 'genre||8||1')
+        other_msg.add_recipient('contacts.LegalEntity', '')
+        self.assertEqual(3, other_msg.contact_nb)
+        self.assertEqual(1, other_msg.get_contact_nosms_nb())
         self.assertEqual(2, sms_msg.prep_sending(), sms_msg.email_to_send)
         sms_msg.status = 2
         sms_msg.save()
@@ -900,6 +1091,8 @@ class SMSTest(LucteriosTest):
 
 
 class SendMessagingTest(AsychronousLucteriosTest):
+    serialized_rollback = True
+    reset_sequences = True
 
     def setUp(self):
         AsychronousLucteriosTest.setUp(self)
@@ -1175,3 +1368,57 @@ class SendMessagingTest(AsychronousLucteriosTest):
         configSMS(max_sms=4)
         clean_sms_testfile(create_new=True)
         self._test_sms1()
+
+
+class PrerenderProcessTest(AsychronousLucteriosTest):
+    serialized_rollback = True
+
+    def setUp(self):
+        AsychronousLucteriosTest.setUp(self)
+        create_jack(firstname="jack", lastname='Dalton')
+        create_jack(firstname="joe", lastname='Dalton')
+        create_jack(firstname="avrel", lastname='Dalton')
+
+    def share_database_with_processes(self):
+        if (connection.vendor != 'sqlite') or not connection.is_in_memory_db():
+            return
+        file_handle, database_file = mkstemp(suffix='.sqlite3')
+        close(file_handle)
+        self.addCleanup(unlink, database_file)
+        connection.ensure_connection()
+        with closing(sqlite3.connect(database_file)) as file_connection:
+            connection.connection.backup(file_connection)
+        self.addCleanup(connection.settings_dict.__setitem__, 'NAME', connection.settings_dict['NAME'])
+        connection.settings_dict['NAME'] = database_file
+
+    def test_prerender_process_pool(self):
+        print_model = PrintModel.objects.create(name="Report", kind="2", modelname="contacts.Individual", value="""
+    <model hmargin="10.0" vmargin="10.0" page_width="210.0" page_height="297.0">
+    <header extent="0.0"/>
+    <bottom extent="0.0"/>
+    <body>
+    <text height="8.0" width="190.0" top="0.0" left="0.0" padding="1.0" spacing="0.0" border_color="black" border_style="" border_width="0.2" text_align="center" line_height="15" font_family="sans-serif" font_weight="" font_size="15">
+    {[b]}#firstname #lastname{[/b]}
+    </text>
+    </body>
+    </model>
+    """)
+        configSMTP('localhost', 1025, nb_render_process=2)
+        email_msg = Message.objects.create(subject="Sending '#reference'", body="{[b]}#name{[/b]}{[br/]}Bye",
+                                           email_to_send="contacts.Individual:0:%d" % print_model.id, message_type=0)
+        email_msg.add_recipient('contacts.Individual', '')
+        email_msg.valid()
+        email_msg.prep_sending()
+        outbox_list = list(email_msg.messageoutbox_set.all())
+        self.assertEqual(3, len(outbox_list))
+        cache_paths = [EmailSent(message=email_msg, email=outbox.email).get_print_file_path() for outbox in outbox_list]
+        for cache_path in cache_paths:
+            if isfile(cache_path):
+                unlink(cache_path)
+
+        self.share_database_with_processes()
+        self.assertTrue(Message.can_render_in_process())
+        print_items = email_msg._prerender_print_files(outbox_list)
+        self.assertEqual(sorted([outbox.email for outbox in outbox_list]), sorted(print_items.keys()))
+        self.assertEqual([True] * len(cache_paths), [PrintFileCache.is_valid(cache_path) for cache_path in cache_paths])
+        self.assertEqual(b"%PDF", PrintFileCache.read(cache_paths[0])[:4])
@@ -38,7 +38,7 @@ from lucterios.CORE.parameters import Params
 from lucterios.CORE.views import ParamEdit
 
 from lucterios.contacts.models import LegalEntity
-from lucterios.mailing.email_functions import will_mail_send, send_email, send_connection_by_email, EmailException
+from lucterios.mailing.email_functions import will_mail_send, send_email, send_connection_by_email, EmailException, DKIMSigner
 from lucterios.mailing.sms_functions import AbstractProvider
 
 
@@ -58,7 +58,7 @@ class Configuration(XferListEditor):
         conf_email_params = ['mailing-smtpserver', 'mailing-smtpport',
                              'mailing-smtpsecurity', 'mailing-smtpuser', 'mailing-smtppass',
                              'mailing-dkim-private-path', 'mailing-dkim-selector',
-                             'mailing-delay-batch', 'mailing-nb-by-batch']
+                             'mailing-delay-batch', 'mailing-nb-by-batch', 'mailing-smtp-engine', 'mailing-nb-connection', 'mailing-nb-render-process']
         Params.fill(self, conf_email_params, 1, 1)
         btn = XferCompButton('editparam-email')
         btn.set_location(3, 1, 1, 5)
@@ -245,3 +245,5 @@ def paramchange_mailing(params):
         provider = AbstractProvider.get_current_instance()
         if provider is not None:
             Params.setvalue('mailing-sms-option', provider.options_text)
+    if ('mailing-dkim-private-path' in params) or ('mailing-dkim-selector' in params):
+        DKIMSigner.clear()
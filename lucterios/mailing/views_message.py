@@ -132,10 +132,12 @@ class MessageClone(XferContainerAcknowledge):
         new_item.message_type = self.item.message_type
         new_item.subject = self.item.subject
         new_item.body = self.item.body
-        new_item.recipients = self.item.recipients
+        new_item.phone_field_names = self.item.phone_field_names
         new_item.email_to_send = ""
         new_item.doc_in_link = self.item.doc_in_link
         new_item.save()
+        for recipient in self.item.get_recipient_list():
+            new_item.add_recipient(recipient.modelname, recipient.criteria)
         for doc in self.item.attachments.all():
             new_item.attachments.add(doc)
         self.params[self.field_id] = new_item.id
@@ -262,7 +264,7 @@ class MessageTransition(XferTransition):
     def fill_confirm(self, transition, trans):
         if transition == 'sending':
             if self.confirme(_("Do you want to sent this message %(nb_msg)d times to %(nb_contact)d contacts?") % {'nb_msg': self.item.prep_sending(),
-                                                                                                                   'nb_contact': self.item.contact_nb - len(self.item.contact_noemail) - len(self.item.contact_nosms)}):
+                                                                                                                   'nb_contact': self.item.contact_nb - self.item.get_contact_noemail_nb() - self.item.get_contact_nosms_nb()}):
                 self._confirmed(transition)
                 self.message(_("This message is being transmitted"))
         else: